@@ -0,0 +1,402 @@
+import argparse
+import importlib
+import logging
+import random
+import string
+import time
+from datetime import datetime, timedelta
+
+from dateutil import parser as dateutil_parser
+from dotenv import load_dotenv
+
+import date_utils
+import hogql
+from bulk_loader import BULK_CONNECT_ARGS, previous_table, replace_table
+from connections import connect, get_session
+from deal_columns import BDR_DEALS, convert_date, format_date_only, get_field_value
+from db_writer import DEFAULT_BATCH_SIZE, build_upsert_query, upsert_rows
+from posthog_common import FULL_REBUILD_START
+from rate_limiter import get_limiter, request
+
+# Micro-benchmarks of the job building blocks. Every benchmark prints its own
+# report; the database ones only touch bench_* tables of the chosen target
+# (TEMPORARY ones, except for the bulk load that has to rename its tables).
+#
+#   python benchmarks.py upsert --target LH_DB --rows 5000
+#   python benchmarks.py bulk --target LH_DB --rows 100000
+#   python benchmarks.py dates --deals 20000
+#   python benchmarks.py deals --deals 20000
+#   python benchmarks.py hogql --rounds 3
+#   python benchmarks.py overview --rounds 3
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def report(name, count, seconds, unit='rows'):
+    rate = count / seconds if seconds else float('inf')
+    print(f"{name:<32} {count:>8} {unit} in {seconds:8.3f}s  ({rate:,.0f} {unit}/s)")
+
+
+BENCH_COLUMNS = ['id', 'name', 'created_at', 'stage', 'owner', 'source', 'notes']
+
+
+def random_rows(count):
+    def text(length):
+        return ''.join(random.choices(string.ascii_letters + ' ', k=length))
+    return [(f"deal-{i:08d}", text(40), '2024-01-01', text(20), text(20), text(20), text(120))
+            for i in range(count)]
+
+
+def bench_upsert(args):
+    """Row-by-row upserts (the old jobs) against the batched writer, on new and on changed rows."""
+    conn = connect(args.target)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TEMPORARY TABLE bench_upsert (
+                    id VARCHAR(255) PRIMARY KEY, name VARCHAR(255), created_at DATE, stage VARCHAR(255),
+                    owner VARCHAR(255), source VARCHAR(255), notes VARCHAR(255)
+                )
+            """)
+        single_query = build_upsert_query('bench_upsert', BENCH_COLUMNS, BENCH_COLUMNS[1:], 1)
+
+        def row_by_row(rows):
+            with conn.cursor() as cursor:
+                for row in rows:
+                    cursor.execute(single_query, row)
+
+        def batched(rows):
+            upsert_rows(conn, 'bench_upsert', BENCH_COLUMNS, rows, batch_size=args.batch_size)
+
+        for name, write in [('row by row', row_by_row), (f'batched ({args.batch_size} rows)', batched)]:
+            with conn.cursor() as cursor:
+                cursor.execute("TRUNCATE TABLE bench_upsert")
+            conn.commit()
+            for phase in ('insert', 'update'):
+                rows = random_rows(args.rows)
+                start = time.perf_counter()
+                write(rows)
+                conn.commit()
+                report(f"{name}, {phase}", len(rows), time.perf_counter() - start)
+    finally:
+        conn.close()
+
+
+def bench_bulk(args):
+    """Full table reload: TRUNCATE + executemany (the old PostHog jobs), batched upserts and the staging swaps."""
+    conn = connect(args.target, **BULK_CONNECT_ARGS)
+    create_query = """
+        CREATE TABLE bench_bulk (
+            id VARCHAR(255) PRIMARY KEY, name VARCHAR(255), created_at DATE, stage VARCHAR(255),
+            owner VARCHAR(255), source VARCHAR(255), notes VARCHAR(255)
+        )
+    """
+    insert_query = f"INSERT INTO bench_bulk ({', '.join(BENCH_COLUMNS)}) VALUES ({', '.join(['%s'] * len(BENCH_COLUMNS))})"
+
+    def truncate_executemany(rows):
+        with conn.cursor() as cursor:
+            cursor.execute("TRUNCATE TABLE bench_bulk")
+            cursor.executemany(insert_query, rows)
+        conn.commit()
+
+    def batched(rows):
+        with conn.cursor() as cursor:
+            cursor.execute("TRUNCATE TABLE bench_bulk")
+        upsert_rows(conn, 'bench_bulk', BENCH_COLUMNS, rows, batch_size=args.batch_size)
+        conn.commit()
+
+    def load_data(rows):
+        replace_table(conn, 'bench_bulk', BENCH_COLUMNS, rows, bulk=True)
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS bench_bulk")
+            cursor.execute(create_query)
+        rows = random_rows(args.rows)
+        for name, reload in [('truncate + executemany', truncate_executemany),
+                             (f'truncate + batched ({args.batch_size} rows)', batched),
+                             ('executemany into copy + swap', lambda rows: replace_table(conn, 'bench_bulk', BENCH_COLUMNS, rows)),
+                             ('LOAD DATA + swap', load_data)]:
+            start = time.perf_counter()
+            reload(rows)
+            report(name, len(rows), time.perf_counter() - start)
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS bench_bulk, {previous_table('bench_bulk')}")
+        conn.close()
+
+
+def random_deal_dates(count):
+    """Date values shaped like the RD Station deals: ISO timestamps with offset and DD/MM/YYYY handoffs."""
+    start = datetime(2023, 1, 1)
+    deals = []
+    for _ in range(count):
+        created = start + timedelta(seconds=random.randrange(700 * 86400), milliseconds=random.randrange(1000))
+        closed = created + timedelta(days=random.randrange(60)) if random.random() < 0.4 else None
+        handoff = created + timedelta(days=random.randrange(10)) if random.random() < 0.5 else None
+        deals.append((
+            created.isoformat(timespec='milliseconds') + '-03:00',
+            closed.isoformat(timespec='milliseconds') + '-03:00' if closed else None,
+            handoff.strftime('%d/%m/%Y') if handoff else None,
+        ))
+    return deals
+
+
+def bench_dates(args):
+    """dateutil (the old deal scripts) against date_utils, cold and warm cache."""
+    deals = random_deal_dates(args.deals)
+    values = sum(value is not None for deal in deals for value in deal)
+
+    def with_dateutil():
+        return [(dateutil_parser.parse(created).date().isoformat(),
+                 dateutil_parser.parse(closed).date().isoformat() if closed else None,
+                 dateutil_parser.parse(handoff, dayfirst=True).date().isoformat() if handoff else None)
+                for created, closed, handoff in deals]
+
+    def with_date_utils():
+        return [(date_utils.iso_date(created),
+                 date_utils.iso_date(closed) if closed else None,
+                 date_utils.br_date(handoff) if handoff else None)
+                for created, closed, handoff in deals]
+
+    start = time.perf_counter()
+    expected = with_dateutil()
+    report("dateutil", values, time.perf_counter() - start, 'values')
+
+    for cache in ('cold', 'warm'):
+        if cache == 'cold':
+            date_utils._iso_day.cache_clear()
+            date_utils._parse_date.cache_clear()
+            date_utils.br_date.cache_clear()
+        start = time.perf_counter()
+        result = with_date_utils()
+        report(f"date_utils, {cache} cache", values, time.perf_counter() - start, 'values')
+        if result != expected:
+            raise AssertionError("date_utils and dateutil disagree")
+
+
+CUSTOM_FIELD_VALUES = {
+    'Executivo de conta': ['Ana', 'Bruno', 'Carla'],
+    'Foi feito handoff?': ['Sim', 'Não'],
+    'Data Handoff': ['05/03/2024', '12/04/2024', '30/06/2024'],
+    'Número Proposta ': ['12345', '67890'],
+    'Marca do carro': ['BMW', 'Audi', 'Volvo'],
+    'Modelo do carro': ['X5', 'Q7', 'XC90'],
+    'Por onde chegou?': ['Google', 'Instagram', 'Indicação'],
+    'Como conheceu a Carbon?': ['Google', 'Amigo'],
+    'Momento de compra': ['Imediato', '3 meses'],
+    'Qual concessionária?': ['SP', 'RJ'],
+    'Observações': ['Cliente recorrente', ''],
+    'Tags': [['vip', 'frota'], ['novo']],
+}
+
+
+def random_deals(count):
+    """Deals shaped like the RD Station API payload, with a dozen custom fields each."""
+    deals = []
+    for (created, closed, _), i in zip(random_deal_dates(count), range(count)):
+        custom_fields = [
+            {'custom_field': {'_id': f'cf{n}', 'label': label}, 'value': random.choice(values)}
+            for n, (label, values) in enumerate(CUSTOM_FIELD_VALUES.items())
+        ]
+        deals.append({
+            '_id': f'deal-{i:08d}', 'name': f'Deal {i}', 'created_at': created, 'closed_at': closed,
+            'win': random.choice([True, False, None]), 'user': {'name': 'Ana'},
+            'deal_stage': {'name': 'Qualificação'}, 'deal_lost_reason': {}, 'deal_source': {'name': 'Site'},
+            'deal_custom_fields': custom_fields,
+        })
+    return deals
+
+
+def legacy_deal_to_row(deal):
+    # The transform of the deal scripts before deal_columns: a label dict per deal and a lookup per column
+    custom_fields = {field["custom_field"]["label"]: field["value"] for field in deal.get("deal_custom_fields", [])}
+    return (
+        deal.get("_id"), deal.get("name"), format_date_only(deal.get("created_at")), deal.get("win"),
+        format_date_only(deal.get("closed_at")), deal.get("user", {}).get("name", ""),
+        deal.get("deal_stage", {}).get("name", ""), deal.get("deal_lost_reason", {}).get("name", ""),
+        deal.get("deal_source", {}).get("name", ""),
+        get_field_value(custom_fields.get("Executivo de conta")),
+        get_field_value(custom_fields.get("Foi feito handoff?")),
+        convert_date(custom_fields.get("Data Handoff")),
+        get_field_value(custom_fields.get("Número Proposta ")),
+        get_field_value(custom_fields.get("Marca do carro")),
+        get_field_value(custom_fields.get("Modelo do carro")),
+        get_field_value(custom_fields.get("Por onde chegou?")),
+        get_field_value(custom_fields.get("Como conheceu a Carbon?")),
+        get_field_value(custom_fields.get("Momento de compra")),
+        get_field_value(custom_fields.get("Qual concessionária?")),
+    )
+
+
+def bench_deals(args):
+    """Per-label dict lookups (the old deal scripts) against the BDR column spec extractor.
+
+    The rounds of the two alternate, so a slower stretch of the machine hits both.
+    """
+    deals = random_deals(args.deals)
+    expected = [legacy_deal_to_row(deal) for deal in deals]  # also warms the date caches for both
+    transforms = {'label dict per deal': lambda deals: [legacy_deal_to_row(deal) for deal in deals],
+                  'column spec extractor': BDR_DEALS.rows}
+    best = dict.fromkeys(transforms, float('inf'))
+    for _ in range(args.rounds):
+        for name, transform in transforms.items():
+            start = time.perf_counter()
+            rows = transform(deals)
+            best[name] = min(best[name], time.perf_counter() - start)
+            if rows != expected:
+                raise AssertionError(f"{name} disagrees with the old transform")
+            del rows
+    for name, seconds in best.items():
+        report(f"{name}, best of {args.rounds}", len(deals), seconds, 'deals')
+
+
+# PostHog jobs whose queries are built by hogql, imported on demand (they need PH_TOKEN)
+HOGQL_JOBS = ['ph_overview', 'ph_rd_events', 'ph_rd_lp_pageviews']
+
+
+def timed_query(job, payload):
+    """Send a query to PostHog, bypassing its result cache. Returns (seconds, results)."""
+    start = time.perf_counter()
+    response = request(get_session(), 'POST', job.api_url, get_limiter('posthog', job.headers['Authorization']),
+                       headers=job.headers, json=dict(payload, refresh='force_blocking'))
+    seconds = time.perf_counter() - start
+    response.raise_for_status()
+    return seconds, response.json()['results']
+
+
+def compare_queries(name, job, old_payload, new_payload, rounds):
+    """Time an old and a new form of a query (best of ``rounds``) and check they return the same rows.
+
+    The rows are compared in any order: the old forms do not always sort them like the new ones.
+    """
+    timings, results = [], []
+    for form, payload in (('old', old_payload), ('new', new_payload)):
+        best = float('inf')
+        for _ in range(rounds):
+            seconds, rows = timed_query(job, payload)
+            best = min(best, seconds)
+        timings.append(best)
+        results.append(sorted(tuple(map(str, row)) for row in rows))
+        report(f"{name}, {form}", len(rows), best, 'rows')
+    old, new = timings
+    print(f"{name:<32} {old / new if new else float('inf'):.1f}x faster, "
+          f"same results: {'yes' if results[0] == results[1] else 'NO'}")
+
+
+def bench_hogql(args):
+    """formatDateTime string filters (old) against raw timestamp ranges (new), per PostHog job."""
+    for name in args.jobs:
+        job = importlib.import_module(name)
+        compare_queries(name, job, job.build_payload(args.start, sargable=False),
+                        job.build_payload(args.start), args.rounds)
+
+
+# ph_overview before its single-pass rewrite: the sessions table is scanned by three subqueries
+LEGACY_OVERVIEW_QUERY = """
+SELECT
+    e.data,
+    e.pageviews,
+    s.sessions,
+    u.users,
+    d.avg_session_duration
+FROM
+    (SELECT
+        {events_day} AS data,
+        COUNT(*) AS pageviews
+    FROM events
+    WHERE event = '$pageview'
+      AND {events_range}
+    GROUP BY data) e
+LEFT JOIN
+    (SELECT
+        {sessions_day} AS data,
+        COUNT(*) AS sessions
+    FROM sessions
+    WHERE {sessions_range}
+    GROUP BY data) s
+ON e.data = s.data
+LEFT JOIN
+    (SELECT
+        {sessions_day} AS data,
+        COUNT(DISTINCT distinct_id) AS users
+    FROM sessions
+    WHERE {sessions_range}
+    GROUP BY data) u
+ON e.data = u.data
+LEFT JOIN
+    (SELECT
+        {sessions_day} AS data,
+        AVG($session_duration) AS avg_session_duration
+    FROM sessions
+    WHERE {sessions_range}
+    GROUP BY data) d
+ON e.data = d.data
+ORDER BY e.data DESC
+LIMIT 10000
+"""
+
+
+def bench_overview(args):
+    """ph_overview with three scans of sessions (old) against the single-pass query (new), same date range."""
+    job = importlib.import_module('ph_overview')
+    old_payload = hogql.payload(LEGACY_OVERVIEW_QUERY.format(
+        events_day=hogql.day('timestamp'),
+        events_range=hogql.date_range('timestamp', args.start),
+        sessions_day=hogql.day('$start_timestamp'),
+        sessions_range=hogql.date_range('$start_timestamp', args.start),
+    ))
+    compare_queries('ph_overview', job, old_payload, job.build_payload(args.start), args.rounds)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the BI job building blocks.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    upsert = subparsers.add_parser('upsert', help='Row-by-row against batched upserts (rows/s).')
+    upsert.add_argument('--target', default='LH_DB', help='Database target to benchmark (prefix of its variables).')
+    upsert.add_argument('--rows', type=int, default=5000, help='Number of rows written per phase.')
+    upsert.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows per batched statement.')
+    upsert.set_defaults(run=bench_upsert)
+
+    bulk = subparsers.add_parser('bulk', help='Full table reload with INSERTs against LOAD DATA (rows/s).')
+    bulk.add_argument('--target', default='LH_DB', help='Database target to benchmark (prefix of its variables).')
+    bulk.add_argument('--rows', type=int, default=100000, help='Number of rows reloaded by each method.')
+    bulk.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows per batched statement.')
+    bulk.set_defaults(run=bench_bulk)
+
+    dates = subparsers.add_parser('dates', help='dateutil against date_utils on deal-shaped dates (values/s).')
+    dates.add_argument('--deals', type=int, default=20000, help='Number of synthetic deals.')
+    dates.set_defaults(run=bench_dates)
+
+    deals = subparsers.add_parser('deals', help='Old deal transform against the column spec extractor (deals/s).')
+    deals.add_argument('--deals', type=int, default=20000, help='Number of synthetic deals.')
+    deals.add_argument('--rounds', type=int, default=5, help='Timed rounds per transform (the best is reported).')
+    deals.set_defaults(run=bench_deals)
+
+    hogql_bench = subparsers.add_parser('hogql', help='Old and sargable date filters of the PostHog queries (seconds).')
+    hogql_bench.add_argument('--jobs', type=lambda value: value.split(','), default=HOGQL_JOBS,
+                             help='Comma-separated PostHog jobs to time.')
+    hogql_bench.add_argument('--start', default=FULL_REBUILD_START,
+                             help='HogQL expression of the day after which events are queried.')
+    hogql_bench.add_argument('--rounds', type=int, default=3, help='Timed rounds per query form (the best is reported).')
+    hogql_bench.set_defaults(run=bench_hogql)
+
+    overview = subparsers.add_parser('overview', help='ph_overview with three sessions scans against one (seconds).')
+    overview.add_argument('--start', default=FULL_REBUILD_START,
+                          help='HogQL expression of the day after which events are queried.')
+    overview.add_argument('--rounds', type=int, default=3, help='Timed rounds per query (the best is reported).')
+    overview.set_defaults(run=bench_overview)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
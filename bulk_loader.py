@@ -0,0 +1,187 @@
+import itertools
+import logging
+import os
+import tempfile
+
+from db_writer import DEFAULT_BATCH_SIZE, ensure_unique_key
+
+# Full table reloads through a staging copy of the table (CREATE TABLE ... LIKE,
+# so it has the exact columns and keys of the job's CREATE TABLE). The rows are
+# written to the copy, with INSERTs or, in bulk mode, streamed into a temporary
+# TSV file and loaded with LOAD DATA LOCAL INFILE. The copy is then published
+# with one atomic RENAME TABLE, so readers never see an empty or half-loaded
+# table, or merged into the table. The replaced table is kept as <table>_old
+# until the next swap, for a quick rollback.
+#
+# Bulk mode needs a connection opened with BULK_CONNECT_ARGS and a server that
+# allows it (local_infile=ON).
+
+BULK_CONNECT_ARGS = {'allow_local_infile': True}
+
+# Escapes of LOAD DATA's default FIELDS ESCAPED BY '\\'
+_TSV_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+
+
+def staging_table(table):
+    """Name of the staging copy of ``table`` that bulk loads go through."""
+    return f"{table}_staging"
+
+
+def previous_table(table):
+    """Name of the table a swap replaced, kept for ``restore_previous_table``."""
+    return f"{table}_old"
+
+
+def tsv_value(value):
+    """Render a value as a LOAD DATA field: ``\\N`` for NULL, 1/0 for booleans, escaped text otherwise."""
+    if value is None:
+        return '\\N'
+    if value is True or value is False:
+        return '1' if value else '0'
+    return str(value).translate(_TSV_ESCAPES)
+
+
+def write_tsv(rows, file):
+    """Write rows to an open text file as tab-separated lines. Returns the number of rows."""
+    count = 0
+    for row in rows:
+        file.write('\t'.join(map(tsv_value, row)) + '\n')
+        count += 1
+    return count
+
+
+def create_staging_table(conn, table):
+    """(Re)create the empty staging copy of ``table``. DDL commits, so call it before the write transaction."""
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {staging_table(table)}")
+        cursor.execute(f"CREATE TABLE {staging_table(table)} LIKE {table}")
+
+
+def drop_staging_table(conn, table):
+    """Drop the staging copy of ``table`` (commits implicitly)."""
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {staging_table(table)}")
+
+
+def load_file(conn, table, columns, path):
+    """Load a TSV file written by ``write_tsv`` into ``table``. Returns the number of loaded rows."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+            f"({', '.join(columns)})",
+            (path,)
+        )
+        return cursor.rowcount
+
+
+def insert_rows(conn, table, columns, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """Insert rows with ``executemany`` (sent as multi-row INSERTs) and commit. Returns the number of rows.
+
+    Rows are taken ``batch_size`` at a time, so a generator is never held in memory.
+    """
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+    rows = iter(rows)
+    count = 0
+    with conn.cursor() as cursor:
+        while batch := list(itertools.islice(rows, batch_size)):
+            cursor.executemany(query, batch)
+            count += len(batch)
+    conn.commit()
+    return count
+
+
+def load_rows(conn, table, columns, rows):
+    """Stream ``rows`` through a temporary TSV file into ``table`` and commit.
+
+    Rows are written to disk as they come, so a generator is never held in
+    memory. Returns the number of loaded rows.
+    """
+    file = tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='\n', suffix='.tsv', delete=False)
+    try:
+        with file:
+            written = write_tsv(rows, file)
+        loaded = load_file(conn, table, columns, file.name)
+        conn.commit()
+    finally:
+        os.remove(file.name)
+    if loaded != written:
+        logging.warning(f"{written} rows written for {table} but {loaded} loaded.")
+    return loaded
+
+
+def swap_staging_table(conn, table):
+    """Publish the loaded staging copy as ``table`` in one atomic RENAME, keeping the replaced table.
+
+    Only the table kept by the previous swap is dropped; the live table is never
+    empty and is only locked for the rename itself.
+    """
+    old_table = previous_table(table)
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {old_table}")
+        cursor.execute(f"RENAME TABLE {table} TO {old_table}, {staging_table(table)} TO {table}")
+
+
+def restore_previous_table(conn, table):
+    """Roll back the last swap: the kept table becomes ``table`` again and the current one is kept instead."""
+    old_table, swap_table = previous_table(table), f"{table}_swap"
+    with conn.cursor() as cursor:
+        cursor.execute(f"RENAME TABLE {table} TO {swap_table}, {old_table} TO {table}, {swap_table} TO {old_table}")
+
+
+def staging_changes(conn, table, key_column, hash_column):
+    """Count the staged rows that are ``new``, ``changed`` or ``unchanged`` by their content hash."""
+    staging = staging_table(table)
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(t.{key_column} IS NULL), 0), "
+            f"COALESCE(SUM(t.{key_column} IS NOT NULL AND NOT (t.{hash_column} <=> s.{hash_column})), 0) "
+            f"FROM {staging} s LEFT JOIN {table} t ON t.{key_column} = s.{key_column}"
+        )
+        total, new, changed = (int(value) for value in cursor.fetchone())
+    return {'new': new, 'changed': changed, 'unchanged': total - new - changed}
+
+
+def merge_staging_table(conn, table, columns, update_columns=None, hash_column=None):
+    """Upsert the staged rows into ``table`` with one ``INSERT ... SELECT``, in the caller's transaction.
+
+    ``update_columns`` defaults to every column but the first (the key). With
+    ``hash_column``, rows whose hash matches the stored one are skipped. Returns
+    MySQL's affected row count (see ``db_writer.BatchWriter``).
+    """
+    staging = staging_table(table)
+    update_columns = list(update_columns) if update_columns is not None else list(columns[1:])
+    query = (f"INSERT INTO {table} ({', '.join(columns)}) "
+             f"SELECT {', '.join(f's.{column}' for column in columns)} FROM {staging} s")
+    if hash_column:
+        query += (f" WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.{columns[0]} = s.{columns[0]} "
+                  f"AND t.{hash_column} <=> s.{hash_column})")
+    # The staging columns are visible here too, so the assigned ones are qualified
+    query += " ON DUPLICATE KEY UPDATE " + ", ".join(f"{table}.{column} = VALUES({column})"
+                                                     for column in update_columns)
+    with conn.cursor() as cursor:
+        cursor.execute(query)
+        return cursor.rowcount
+
+
+def replace_table(conn, table, columns, rows, bulk=False, unique_key=None):
+    """Replace the whole content of ``table`` with ``rows`` through its staging copy.
+
+    The rows are inserted (or, with ``bulk``, loaded with LOAD DATA) into the
+    copy and the table is only touched by the final RENAME, so readers see the
+    old rows until the new ones are complete. If loading fails the table is left
+    as it was. ``unique_key`` is an ``(index name, columns)`` pair the published
+    table must have; it is added to the empty copy when the table predates it.
+    Returns the number of loaded rows.
+    """
+    create_staging_table(conn, table)
+    try:
+        if unique_key:
+            ensure_unique_key(conn, staging_table(table), *unique_key)
+        loaded = (load_rows if bulk else insert_rows)(conn, staging_table(table), columns, rows)
+        swap_staging_table(conn, table)
+    except Exception:
+        drop_staging_table(conn, table)
+        raise
+    logging.info(f"Loaded {loaded} rows into {table}{' (bulk)' if bulk else ''}.")
+    return loaded
@@ -0,0 +1,138 @@
+import logging
+import os
+import threading
+
+import mysql.connector
+import requests
+from requests.adapters import HTTPAdapter
+
+# HTTP sessions and MySQL connections shared by every job running in this process.
+# When the runner executes the jobs in-process, a job reuses the warm sessions and
+# idle connections left behind by the previous cycle instead of opening new ones.
+
+_lock = threading.Lock()
+_sessions = {}
+_pools = {}
+
+
+def get_session(name='default', retries=None, pool_maxsize=10):
+    """Return the process-wide keep-alive session registered under ``name``.
+
+    The session is created on first use; ``retries`` (a urllib3 ``Retry``) is only
+    applied at that point, so every caller of the same name shares one policy.
+    """
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(max_retries=retries or 0, pool_connections=pool_maxsize,
+                                  pool_maxsize=pool_maxsize)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[name] = session
+        return session
+
+
+def db_config(prefix='DB'):
+    """Read the connection settings of a MySQL target from ``<prefix>_USER``, ``<prefix>_HOST``, etc."""
+    return {
+        'user': os.getenv(f'{prefix}_USER'),
+        'password': os.getenv(f'{prefix}_PASSWORD'),
+        'host': os.getenv(f'{prefix}_HOST'),
+        'database': os.getenv(f'{prefix}_NAME'),
+    }
+
+
+class PooledConnection:
+    """MySQL connection whose ``close()`` hands it back to the pool instead of closing it."""
+
+    def __init__(self, conn, pool):
+        self._conn = conn
+        self._pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def is_connected(self):
+        return self._conn is not None and self._conn.is_connected()
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._pool.release(conn)
+
+
+class ConnectionPool:
+    """Lazy pool of MySQL connections to a single target.
+
+    Connections are only opened on demand and idle ones are kept for the next
+    caller, so a single-job process opens exactly one connection.
+    """
+
+    def __init__(self, prefix, **connect_args):
+        self.prefix = prefix
+        self.connect_args = connect_args
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                break
+            try:
+                conn.ping(reconnect=True, attempts=1)
+                return PooledConnection(conn, self)
+            except mysql.connector.Error:
+                logging.info(f"Discarding stale {self.prefix} connection.")
+        conn = mysql.connector.connect(**db_config(self.prefix), **self.connect_args)
+        return PooledConnection(conn, self)
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except mysql.connector.Error:
+            conn.close()
+            return
+        with self._lock:
+            self._idle.append(conn)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                conn.close()
+            except mysql.connector.Error:
+                pass
+
+
+def connect(prefix='DB', **connect_args):
+    """Return a connection to the MySQL target configured by the ``<prefix>_*`` variables.
+
+    Raises ``mysql.connector.Error`` like ``mysql.connector.connect``. Closing the
+    returned connection keeps it open for the next job of this process.
+    """
+    key = (prefix, repr(sorted(connect_args.items())))
+    with _lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(prefix, **connect_args)
+            _pools[key] = pool
+    return pool.get()
+
+
+def close_all():
+    """Close every idle pooled connection and HTTP session of this process."""
+    with _lock:
+        pools = list(_pools.values())
+        sessions = list(_sessions.values())
+        _pools.clear()
+        _sessions.clear()
+    for pool in pools:
+        pool.close_all()
+    for session in sessions:
+        session.close()
@@ -0,0 +1,60 @@
+import re
+from datetime import date, datetime, timezone
+from functools import lru_cache
+
+from dateutil import parser
+
+# Date normalization for the RD Station deals. The API only sends a couple of
+# formats, so those are parsed directly and dateutil is only the fallback for
+# anything unexpected. Results are cached: a sync sees the same days and the
+# same "Data Handoff" values over and over.
+#
+#   ISO-8601 with offset:  2024-03-05T14:32:11.123-03:00  (created_at, closed_at, updated_at)
+#   DD/MM/YYYY:            05/03/2024                     (date custom fields)
+
+_BR_DATE = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})')
+
+
+@lru_cache(maxsize=4096)
+def _iso_day(day):
+    return date.fromisoformat(day).isoformat()
+
+
+@lru_cache(maxsize=4096)
+def _parse_date(value, dayfirst):
+    return parser.parse(value, dayfirst=dayfirst).date().isoformat()
+
+
+def iso_date(value):
+    """Return the ``YYYY-MM-DD`` date of an ISO-8601 timestamp, as written (no timezone conversion).
+
+    Raises ``ValueError`` like ``dateutil`` when the value cannot be parsed.
+    """
+    if value[10:11] in ('', 'T', ' '):
+        try:
+            return _iso_day(value[:10])
+        except ValueError:
+            pass
+    return _parse_date(value, False)
+
+
+@lru_cache(maxsize=4096)
+def br_date(value):
+    """Convert a ``DD/MM/YYYY`` date to ``YYYY-MM-DD``, falling back to a day-first dateutil parse."""
+    match = _BR_DATE.fullmatch(value)
+    if match:
+        day, month, year = match.groups()
+        return date(int(year), int(month), int(day)).isoformat()
+    return _parse_date(value, True)
+
+
+@lru_cache(maxsize=4096)
+def parse_datetime(value):
+    """Parse an ISO-8601 timestamp into an aware datetime (UTC if it has no offset)."""
+    try:
+        timestamp = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except ValueError:
+        timestamp = parser.parse(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
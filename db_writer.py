@@ -0,0 +1,320 @@
+import hashlib
+import itertools
+import json
+import logging
+
+# Batched MySQL upserts shared by the jobs. Rows are sent as multi-row
+# INSERT ... ON DUPLICATE KEY UPDATE statements instead of one round trip per
+# row. A batch is flushed when it reaches ``batch_size`` rows or when its
+# estimated size would get close to the server's max_allowed_packet.
+
+DEFAULT_BATCH_SIZE = 500
+
+# Share of max_allowed_packet a statement may use; the rest covers the SQL
+# text, quoting and escaping that the size estimate does not count.
+PACKET_HEADROOM = 0.75
+
+# Column holding the content hash of a row, see upsert_changed_rows()
+HASH_COLUMN = 'row_hash'
+
+# Rows removed per DELETE (and per commit) by delete_rows_not_in()
+DEFAULT_DELETE_CHUNK = 1000
+
+
+def max_allowed_packet(conn):
+    """Return the max_allowed_packet of the connection's server, in bytes."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT @@max_allowed_packet")
+        return int(cursor.fetchone()[0])
+
+
+def estimate_row_size(row):
+    """Rough size of a row once rendered into the statement, in bytes."""
+    return sum(len(str(value).encode('utf-8')) + 4 for value in row)
+
+
+def build_upsert_query(table, columns, update_columns, row_count):
+    """Build a multi-row ``INSERT ... ON DUPLICATE KEY UPDATE`` with ``row_count`` value tuples."""
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES " + ", ".join([placeholders] * row_count)
+    if update_columns:
+        query += " ON DUPLICATE KEY UPDATE " + ", ".join(f"{column} = VALUES({column})" for column in update_columns)
+    return query
+
+
+class BatchWriter:
+    """Accumulate rows and upsert them into ``table`` in batches.
+
+    ``update_columns`` defaults to every column but the first (the key).
+    ``affected_rows`` adds up MySQL's affected rows: 1 per new row, 2 per changed
+    row and, on connections without FOUND_ROWS, 0 per unchanged row. The caller
+    owns the transaction; use as a context manager or call ``flush()`` at the end.
+    """
+
+    def __init__(self, conn, table, columns, update_columns=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.conn = conn
+        self.table = table
+        self.columns = list(columns)
+        self.update_columns = list(update_columns) if update_columns is not None else self.columns[1:]
+        self.batch_size = batch_size
+        self.max_bytes = int(max_allowed_packet(conn) * PACKET_HEADROOM)
+        self.affected_rows = 0
+        self.rows_written = 0
+        self._rows = []
+        self._bytes = 0
+
+    def add(self, row):
+        size = estimate_row_size(row)
+        if self._rows and (len(self._rows) >= self.batch_size or self._bytes + size > self.max_bytes):
+            self.flush()
+        self._rows.append(tuple(row))
+        self._bytes += size
+
+    def add_many(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def flush(self):
+        if not self._rows:
+            return
+        rows, self._rows, self._bytes = self._rows, [], 0
+        query = build_upsert_query(self.table, self.columns, self.update_columns, len(rows))
+        params = [value for row in rows for value in row]
+        with self.conn.cursor() as cursor:
+            cursor.execute(query, params)
+            self.affected_rows += cursor.rowcount
+        self.rows_written += len(rows)
+        logging.debug(f"Upserted a batch of {len(rows)} rows into {self.table}.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        return False
+
+
+def upsert_rows(conn, table, columns, rows, update_columns=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Upsert ``rows`` into ``table`` in batches and return the affected row count (see ``BatchWriter``)."""
+    with BatchWriter(conn, table, columns, update_columns, batch_size) as writer:
+        writer.add_many(rows)
+    return writer.affected_rows
+
+
+def row_hash(row):
+    """MD5 of a row's values, as stored in the ``row_hash`` column."""
+    return hashlib.md5(json.dumps(row, default=str, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def ensure_column(conn, table, column, definition):
+    """Add ``column`` (e.g. ``'CHAR(32)'`` as ``definition``) to a table created before it existed.
+
+    ALTER TABLE commits implicitly, so call this before starting the write transaction.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+            (table, column)
+        )
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            logging.info(f"Added column {column} to {table}.")
+
+
+def ensure_column_collation(conn, table, column, definition, collation):
+    """Convert ``column`` (``definition``, e.g. ``'VARCHAR(255)'``) to ``collation`` if it uses another one.
+
+    ALTER TABLE commits implicitly, so call this before starting the write transaction.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT COLLATION_NAME FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+            (table, column)
+        )
+        row = cursor.fetchone()
+        if row and row[0] != collation:
+            charset = collation.split('_')[0]
+            cursor.execute(f"ALTER TABLE {table} MODIFY COLUMN {column} {definition} "
+                           f"CHARACTER SET {charset} COLLATE {collation}")
+            logging.info(f"Changed the collation of {table}.{column} to {collation}.")
+
+
+def ensure_hash_column(conn, table):
+    """Add the ``row_hash`` column to a table created before it existed (see ``ensure_column``)."""
+    ensure_column(conn, table, HASH_COLUMN, 'CHAR(32)')
+
+
+def has_index(conn, table, index_name):
+    """Whether ``table`` has an index (or key) named ``index_name``."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+            (table, index_name)
+        )
+        return cursor.fetchone()[0] > 0
+
+
+def ensure_unique_key(conn, table, index_name, columns):
+    """Add the unique key ``index_name`` on ``columns`` to a table created before it existed.
+
+    Fails if the table holds duplicates, so it is meant for empty tables (a
+    staging copy) or tables known to be unique. ALTER TABLE commits implicitly.
+    """
+    if not has_index(conn, table, index_name):
+        with conn.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {table} ADD UNIQUE KEY {index_name} ({', '.join(columns)})")
+        logging.info(f"Added unique key {index_name} ({', '.join(columns)}) to {table}.")
+
+
+def load_row_hashes(conn, table, key_column, keys):
+    """Return ``{key: row_hash}`` for the rows of the table whose key is in ``keys``."""
+    keys = list(keys)
+    if not keys:
+        return {}
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT {key_column}, {HASH_COLUMN} FROM {table} "
+                       f"WHERE {key_column} IN ({', '.join(['%s'] * len(keys))})", keys)
+        return dict(cursor.fetchall())
+
+
+def upsert_changed_rows(conn, table, columns, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """Upsert only the rows whose content differs from what the table holds.
+
+    The first column is the key. The rows are read ``batch_size`` at a time and
+    the stored ``row_hash`` of each batch's keys is looked up on the primary key,
+    so an incremental run reads the hashes of its own rows only. Unchanged rows
+    are not sent at all, so a cycle where nothing changed writes nothing.
+    Returns the counts of ``new``, ``changed`` and ``unchanged`` rows.
+    """
+    counts = {'new': 0, 'changed': 0, 'unchanged': 0}
+    # Hashes written by this call, for keys that come again in a later batch
+    written = {}
+    rows = iter(rows)
+    with BatchWriter(conn, table, [*columns, HASH_COLUMN], batch_size=batch_size) as writer:
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            stored_hashes = load_row_hashes(conn, table, columns[0], {row[0] for row in batch} - written.keys())
+            for row in batch:
+                digest = row_hash(row)
+                stored = written if row[0] in written else stored_hashes
+                if row[0] not in stored:
+                    counts['new'] += 1
+                elif stored[row[0]] == digest:
+                    counts['unchanged'] += 1
+                    continue
+                else:
+                    counts['changed'] += 1
+                written[row[0]] = digest
+                writer.add((*row, digest))
+    return counts
+
+
+def sweep_table(table):
+    """Name of the table holding the keys seen by the current full sweep of ``table``."""
+    return f"{table}_sweep_keys"
+
+
+def sweep_state_table(table):
+    """Name of the one-row table recording which sweep the keys in ``sweep_table`` belong to."""
+    return f"{table}_sweep_state"
+
+
+def create_sweep_table(conn, table, key_column='id', key_type='VARCHAR(255)'):
+    """Create the sweep key and state tables of ``table``. DDL commits, so call it before the write transaction."""
+    with conn.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {sweep_table(table)} ({key_column} {key_type} PRIMARY KEY)")
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {sweep_state_table(table)} "
+                       "(id TINYINT PRIMARY KEY, sweep_id VARCHAR(64), next_page INT)")
+
+
+def save_sweep_state(conn, table, sweep_id, next_page):
+    """Record, in the caller's transaction, that the sweep keys belong to ``sweep_id`` and resume at ``next_page``.
+
+    Written in the same transaction as ``add_sweep_keys``, so the keys and the
+    page they lead up to can never disagree.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {sweep_state_table(table)} (id, sweep_id, next_page) VALUES (1, %s, %s) "
+            "ON DUPLICATE KEY UPDATE sweep_id = VALUES(sweep_id), next_page = VALUES(next_page)",
+            (sweep_id, next_page)
+        )
+
+
+def load_sweep_state(conn, table):
+    """Return the ``(sweep_id, next_page)`` of the interrupted sweep whose keys are stored, or None."""
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT sweep_id, next_page FROM {sweep_state_table(table)} WHERE id = 1")
+        row = cursor.fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def add_sweep_keys(conn, table, key_column, keys, restart=False, batch_size=DEFAULT_BATCH_SIZE):
+    """Record keys seen by the full sweep of ``table``, in the caller's transaction.
+
+    ``restart`` empties the key table first, for a sweep that starts at the
+    beginning; a resumed sweep adds to the keys of the runs before it.
+    """
+    if restart:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {sweep_table(table)}")
+    upsert_rows(conn, sweep_table(table), [key_column], ((key,) for key in keys),
+                update_columns=[key_column], batch_size=batch_size)
+
+
+def finish_sweep(conn, table, key_column, chunk_size=DEFAULT_DELETE_CHUNK):
+    """Delete the rows of ``table`` the complete sweep did not see and empty its key and state tables.
+
+    Returns the number of deleted rows (see ``delete_rows_not_in``).
+    """
+    deleted = delete_rows_not_in(conn, table, key_column, sweep_table(table), chunk_size)
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {sweep_table(table)}")
+        cursor.execute(f"DELETE FROM {sweep_state_table(table)}")
+    conn.commit()
+    return deleted
+
+
+def delete_rows_not_in(conn, table, key_column, keys_table, chunk_size=DEFAULT_DELETE_CHUNK):
+    """Delete the rows of ``table`` whose key is not in ``keys_table``, on the server.
+
+    ``keys_table`` is the persistent ``<table>_sweep_keys`` table of the sweep
+    (see ``sweep_table``) rather than a temporary staging table: it outlives an
+    interrupted run, so a resumed sweep still holds the keys of the pages
+    fetched before. The table is walked in key order, ``chunk_size`` keys at a
+    time: each chunk is bounded by its last key and its obsolete rows are removed
+    with an anti-join DELETE ordered on the key, so no chunk rescans the rows
+    before it. Every chunk is committed (together with whatever the caller's
+    transaction held), so no DELETE keeps its locks for long. An empty
+    ``keys_table`` deletes nothing. Returns the number of deleted rows.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {keys_table})")
+        if not cursor.fetchone()[0]:
+            logging.warning(f"No keys in {keys_table}, not deleting anything from {table}.")
+            return 0
+
+    not_in_keys = f"NOT EXISTS (SELECT 1 FROM {keys_table} WHERE {keys_table}.{key_column} = {table}.{key_column})"
+    deleted, last_key = 0, None
+    while True:
+        # The chunk after the last one: the keys up to the chunk_size-th one
+        after, params = ("", ()) if last_key is None else (f" WHERE {key_column} > %s", (last_key,))
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT MAX({key_column}) FROM (SELECT {key_column} FROM {table}{after} "
+                           f"ORDER BY {key_column} LIMIT {int(chunk_size)}) AS chunk", params)
+            upper = cursor.fetchone()[0]
+            if upper is None:
+                return deleted
+            lower = "" if last_key is None else f"{key_column} > %s AND "
+            cursor.execute(f"DELETE FROM {table} WHERE {lower}{key_column} <= %s AND {not_in_keys} "
+                           f"ORDER BY {key_column}", (*params, upper))
+            count = cursor.rowcount
+        conn.commit()
+        deleted += count
+        last_key = upper
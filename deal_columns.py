@@ -0,0 +1,223 @@
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from date_utils import br_date, iso_date
+
+# Declarative column specs of the RD Station deal tables. Each column reads a
+# field of the deal (a dotted path such as 'user.name') or a custom field,
+# matched by its ID or by its label with surrounding spaces ignored, and
+# optionally converts the value. A spec is resolved once into a DealExtractor
+# that turns deals into rows column by column, with a single pass over their
+# custom fields.
+
+
+def get_field_value(field_value):
+    """Process custom field values uniformly."""
+    if field_value.__class__ is str:
+        return field_value
+    elif isinstance(field_value, list):
+        return ", ".join(map(str, field_value))
+    elif field_value is not None:
+        return str(field_value)
+    else:
+        return ""
+
+
+def format_date_only(datetime_str):
+    """Format datetime string to date in YYYY-MM-DD format."""
+    if datetime_str:
+        try:
+            return iso_date(datetime_str)
+        except (ValueError, TypeError, OverflowError) as e:
+            logging.error(f"Error parsing date '{datetime_str}': {e}")
+    return None
+
+
+def convert_date(date_str):
+    """Convert date string from DD/MM/YYYY to YYYY-MM-DD format."""
+    if date_str:
+        try:
+            return br_date(date_str)
+        except (ValueError, TypeError, OverflowError) as e:
+            logging.error(f"Error converting date '{date_str}': {e}")
+    return None
+
+
+@dataclass(frozen=True)
+class Column:
+    """A column of a deal table: where its value comes from and how it is converted.
+
+    Set either ``field`` (a deal attribute, ``'user.name'`` for a nested one) or
+    ``custom_field`` (the ID or label of a custom field). ``default`` is used when
+    the value is missing; ``convert`` is applied to every value, missing or not.
+    ``sql_type`` is the MySQL type of the column.
+    """
+    name: str
+    field: Optional[str] = None
+    custom_field: Optional[str] = None
+    convert: Optional[Callable[[Any], Any]] = None
+    default: Any = None
+    sql_type: str = 'VARCHAR(255)'
+
+
+def create_table_query(table, columns, extra_columns=()):
+    """``CREATE TABLE IF NOT EXISTS`` for a column spec; the first column is the primary key.
+
+    ``extra_columns`` are appended as given, e.g. ``'row_hash CHAR(32)'``.
+    """
+    definitions = [f"{column.name} {column.sql_type}" for column in columns]
+    definitions[0] += " PRIMARY KEY"
+    definitions += list(extra_columns)
+    return f"CREATE TABLE IF NOT EXISTS {table} (\n    " + ",\n    ".join(definitions) + "\n)"
+
+
+# Stands in for a missing nested object (e.g. a deal without 'user')
+EMPTY = {}
+
+# Deals extracted at a time: small enough for a chunk to stay in the CPU cache
+# while every column goes over it
+CHUNK_SIZE = 128
+
+
+class CustomFieldSlots:
+    """The custom fields of one or more column specs, each given a slot once.
+
+    Extractors built on the same table share it: a custom field is resolved by
+    ID, then by label with surrounding spaces ignored, the first time its ID is
+    seen by any of them, and afterwards it costs one dict lookup. Fields that no
+    spec reads resolve to -1.
+    """
+
+    def __init__(self, columns):
+        self.slots = {}
+        for column in columns:
+            if column.custom_field is not None:
+                self.slots.setdefault(column.custom_field.strip(), len(self.slots))
+        self.resolved = {}
+
+    def __len__(self):
+        return len(self.slots)
+
+    def resolve(self, definition):
+        """Slot of a custom field definition (``{'_id': ..., 'label': ...}``), remembered by ID."""
+        field_id, label = definition.get('_id'), definition.get('label')
+        slot = self.slots.get(field_id)
+        if slot is None:
+            slot = self.slots.get(label.strip(), -1) if isinstance(label, str) else -1
+        if field_id is not None:
+            self.resolved[field_id] = slot
+        return slot
+
+
+class DealExtractor:
+    """A column spec turned into a function from deals to row tuples.
+
+    The spec is resolved once into a slot map: each column reads either a deal
+    field or a slot of ``custom_fields``, the custom field table shared with
+    the other deal specs. ``rows`` then works column by column over chunks of
+    deals: a single pass drops every custom value of the chunk into the column
+    of its slot, each deal field is read into its column by a comprehension,
+    converters run over whole columns and ``zip`` builds the row tuples. The
+    column lists belong to the chunk, so a deal allocates nothing but its row.
+    """
+
+    def __init__(self, columns, custom_fields=None):
+        self.columns = list(columns)
+        self.names = [column.name for column in self.columns]
+        self.custom_fields = CustomFieldSlots(self.columns) if custom_fields is None else custom_fields
+        # Default of every custom slot, plus a spare slot for the custom fields no spec reads
+        self._defaults = [None] * (len(self.custom_fields) + 1)
+        # (custom slot, deal field, nested field, default, converter) of every column, in table order;
+        # the custom slot is None for deal fields
+        self._slots = []
+        for column in self.columns:
+            if column.custom_field is not None:
+                slot = self.custom_fields.slots.get(column.custom_field.strip())
+                if slot is None:
+                    raise ValueError(f"Custom field {column.custom_field!r} is not in the custom field table")
+                self._defaults[slot] = column.default
+                self._slots.append((slot, None, None, column.default, column.convert))
+            else:
+                key, _, subkey = column.field.partition('.')
+                self._slots.append((None, key, subkey, column.default, column.convert))
+
+    def rows(self, deals):
+        """Build the rows of some deals, in column order."""
+        deals = list(deals)
+        rows = []
+        for start in range(0, len(deals), CHUNK_SIZE):
+            rows += self._chunk_rows(deals[start:start + CHUNK_SIZE])
+        return rows
+
+    def extract(self, deal):
+        """Build the row of a single deal."""
+        return self._chunk_rows([deal])[0]
+
+    def _chunk_rows(self, deals):
+        slots, resolve = self.custom_fields.resolved, self.custom_fields.resolve
+        custom = [[default] * len(deals) for default in self._defaults]
+        for index, deal in enumerate(deals):
+            custom_fields = deal.get('deal_custom_fields') or ()
+            try:
+                for custom_field in custom_fields:
+                    custom[slots[custom_field['custom_field']['_id']]][index] = custom_field['value']
+            except KeyError:
+                # A custom field seen for the first time (or without an ID): resolve them one by one
+                for custom_field in custom_fields:
+                    definition = custom_field['custom_field']
+                    slot = slots.get(definition.get('_id'))
+                    if slot is None:
+                        slot = resolve(definition)
+                    custom[slot][index] = custom_field['value']
+
+        columns = []
+        for slot, key, subkey, default, convert in self._slots:
+            if slot is not None:
+                values = custom[slot]
+            elif subkey:
+                values = [(deal.get(key) or EMPTY).get(subkey, default) for deal in deals]
+            else:
+                values = [deal.get(key, default) for deal in deals]
+            if convert is None:
+                columns.append(values)
+            elif convert is get_field_value:
+                # Custom field values are mostly text already: only convert the others
+                columns.append([value if value.__class__ is str else get_field_value(value) for value in values])
+            else:
+                columns.append([convert(value) for value in values])
+        return list(zip(*columns))
+
+
+# Columns shared by the SDR and BDR deal tables, in table order
+DEAL_COLUMNS = [
+    Column('id', '_id'),
+    Column('name', 'name'),
+    Column('created_at', 'created_at', convert=format_date_only, sql_type='DATE'),
+    Column('win', 'win', sql_type='BOOLEAN'),
+    Column('closed_at', 'closed_at', convert=format_date_only, sql_type='DATE'),
+    Column('user_name', 'user.name', default=''),
+    Column('deal_stage_name', 'deal_stage.name', default=''),
+    Column('deal_lost_reason_name', 'deal_lost_reason.name', default=''),
+    Column('deal_source_name', 'deal_source.name', default=''),
+    Column('executivo_de_conta', custom_field='Executivo de conta', convert=get_field_value),
+    Column('foi_feito_handoff', custom_field='Foi feito handoff?', convert=get_field_value),
+    Column('data_handoff', custom_field='Data Handoff', convert=convert_date, sql_type='DATE'),
+    Column('numero_proposta', custom_field='Número Proposta', convert=get_field_value),
+    Column('marca_do_carro', custom_field='Marca do carro', convert=get_field_value),
+    Column('modelo_do_carro', custom_field='Modelo do carro', convert=get_field_value),
+    Column('por_onde_chegou', custom_field='Por onde chegou?', convert=get_field_value),
+    Column('como_conheceu_carbon', custom_field='Como conheceu a Carbon?', convert=get_field_value),
+    Column('momento_de_compra', custom_field='Momento de compra', convert=get_field_value),
+]
+
+BDR_COLUMNS = DEAL_COLUMNS + [
+    Column('concessionaria', custom_field='Qual concessionária?', convert=get_field_value),
+]
+
+# One custom field table for both pipelines: a field is resolved once, whichever pipeline sees it first
+DEAL_CUSTOM_FIELDS = CustomFieldSlots(BDR_COLUMNS)
+
+SDR_DEALS = DealExtractor(DEAL_COLUMNS, DEAL_CUSTOM_FIELDS)
+
+BDR_DEALS = DealExtractor(BDR_COLUMNS, DEAL_CUSTOM_FIELDS)
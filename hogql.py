@@ -0,0 +1,48 @@
+# Small HogQL builder for the PostHog jobs. Date filters are generated as
+# ranges on the raw timestamp column (timestamp, $start_timestamp...), which
+# lets ClickHouse prune partitions and compare native dates, instead of
+# formatting every row's timestamp into a string first. The string form is
+# still available (sargable=False) so benchmarks.py can time both.
+#
+# Bounds are HogQL date expressions, e.g. today() or toStartOfYear(today()), and
+# follow the jobs' convention: the days strictly after ``after`` up to ``until``
+# included.
+
+DAY_FORMAT = '%Y-%m-%d'
+
+
+def day(column, sargable=True):
+    """The day of a timestamp column, for SELECT and GROUP BY (``YYYY-MM-DD`` in the results either way)."""
+    if sargable:
+        return f"toDate({column})"
+    return f"formatDateTime({column}, '{DAY_FORMAT}')"
+
+
+def date_range(column, after, until='today()', sargable=True):
+    """Predicate keeping the rows of the days after ``after`` up to ``until`` included."""
+    if sargable:
+        return (f"{column} >= plus({after}, toIntervalDay(1)) "
+                f"AND {column} < plus({until}, toIntervalDay(1))")
+    return (f"formatDateTime({column}, '{DAY_FORMAT}') <= formatDateTime({until}, '{DAY_FORMAT}') "
+            f"AND formatDateTime({column}, '{DAY_FORMAT}') > formatDateTime({after}, '{DAY_FORMAT}')")
+
+
+def select(columns, source, where=(), group_by=(), order_by=(), limit=None, offset=None):
+    """Build a SELECT from its parts; ``where`` predicates are joined with AND."""
+    query = f"SELECT {', '.join(columns)}\nFROM {source}"
+    if where:
+        query += "\nWHERE " + "\n  AND ".join(f"({predicate})" for predicate in where)
+    if group_by:
+        query += "\nGROUP BY " + ", ".join(group_by)
+    if order_by:
+        query += "\nORDER BY " + ", ".join(order_by)
+    if limit is not None:
+        query += f"\nLIMIT {int(limit)}"
+    if offset:
+        query += f"\nOFFSET {int(offset)}"
+    return query
+
+
+def payload(query):
+    """Body of a HogQL request to the PostHog query API."""
+    return {"query": {"kind": "HogQLQuery", "query": query}}
@@ -0,0 +1,292 @@
+import importlib
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from rate_limiter import throttling_report
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Maximum number of jobs running at the same time against each upstream API
+DEFAULT_UPSTREAM_LIMITS = {
+    'posthog': 2,
+    'rd_station': 2,
+    'trello': 1,
+}
+
+
+@dataclass(frozen=True)
+class Job:
+    """A single BI job: the script to run, the API it talks to and the jobs it waits for.
+
+    ``args`` are passed to the script's ``main(argv)`` (or its command line when run
+    as a subprocess). ``isolated`` jobs always run in their own interpreter.
+    """
+    name: str
+    script: str
+    upstream: str
+    depends_on: Tuple[str, ...] = ()
+    args: Tuple[str, ...] = ()
+    isolated: bool = False
+
+    @property
+    def module_name(self):
+        return os.path.splitext(os.path.basename(self.script))[0]
+
+
+@dataclass
+class JobResult:
+    """Outcome of a job run: 'ok', 'failed' or 'skipped' (an upstream dependency failed).
+
+    ``changes`` is the number of rows the job inserted, changed or deleted, when the
+    job reports it (in-process runs whose ``main()`` returns an int).
+    """
+    name: str
+    status: str
+    seconds: float = 0.0
+    changes: Optional[int] = None
+
+
+# Databases every job writes to, fetched once per job (see sinks.py). The runner
+# historically filled the local database only; use DB_TARGETS=DB,LH_DB for both.
+TARGETS = os.getenv('DB_TARGETS', 'LH_DB')
+
+# Job graph executed on every cycle. None of the jobs read each other's tables,
+# so they only compete for their upstream API and can all run in parallel.
+JOBS = [
+    Job('ph_queries', 'ph_queries.py', 'posthog', args=('--targets', TARGETS)),
+    Job('rd_station_deals', 'rd_station_deals.py', 'rd_station', args=('--targets', TARGETS)),
+    Job('trello', 'trello.py', 'trello', args=('--targets', TARGETS)),
+]
+
+
+def validate_graph(jobs: List[Job]):
+    """Check that job names are unique, dependencies exist and the graph has no cycles."""
+    names = [job.name for job in jobs]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate job names: {', '.join(sorted(duplicates))}")
+
+    by_name = {job.name: job for job in jobs}
+    for job in jobs:
+        missing = [dep for dep in job.depends_on if dep not in by_name]
+        if missing:
+            raise ValueError(f"Job {job.name} depends on unknown jobs: {', '.join(missing)}")
+
+    visiting, visited = set(), set()
+
+    def visit(name):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle detected at job {name}")
+        visiting.add(name)
+        for dep in by_name[name].depends_on:
+            visit(dep)
+        visiting.remove(name)
+        visited.add(name)
+
+    for name in names:
+        visit(name)
+
+
+def execute_script(script_path, args=()):
+    """Execute a single script and log its status. Returns True on success."""
+    start_time = time.time()
+    try:
+        logging.info(f"Executing: {script_path}")
+        subprocess.run(['python', script_path, *args], check=True)
+        execution_time = time.time() - start_time
+        logging.info(f"Completed: {script_path} in {execution_time:.2f} seconds")
+        return True
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Script {script_path} failed with error code {e.returncode}")
+    except Exception as e:
+        logging.exception(f"Error executing script {script_path}: {e}")
+    return False
+
+
+# Job modules imported by the in-process mode, kept across cycles, and the
+# time each one took to import the first time.
+_modules = {}
+_import_seconds: Dict[str, float] = {}
+_import_lock = threading.Lock()
+
+
+def load_job_module(job: Job, base_path: str):
+    """Import the job's module once per process and return it."""
+    with _import_lock:
+        module = _modules.get(job.module_name)
+        if module is None:
+            if base_path not in sys.path:
+                sys.path.insert(0, base_path)
+            start_time = time.time()
+            module = importlib.import_module(job.module_name)
+            _import_seconds[job.module_name] = time.time() - start_time
+            _modules[job.module_name] = module
+        return module
+
+
+def execute_in_process(job: Job, base_path: str):
+    """Call the job module's ``main(argv)`` in this process.
+
+    Returns ``(ok, changes)``, where ``changes`` is the value returned by ``main()``
+    if it is an int and None otherwise.
+    """
+    start_time = time.time()
+    try:
+        logging.info(f"Executing in-process: {job.script}")
+        module = load_job_module(job, base_path)
+        returned = module.main(list(job.args))
+        execution_time = time.time() - start_time
+        logging.info(f"Completed: {job.script} in {execution_time:.2f} seconds")
+        changes = returned if isinstance(returned, int) and not isinstance(returned, bool) else None
+        return True, changes
+    except SystemExit as e:
+        if e.code in (None, 0):
+            logging.info(f"Completed: {job.script} in {time.time() - start_time:.2f} seconds")
+            return True, None
+        logging.error(f"Script {job.script} failed with exit code {e.code}")
+    except Exception as e:
+        logging.exception(f"Error executing script {job.script}: {e}")
+    return False, None
+
+
+def run_job(job: Job, base_path: str, mode: str = 'subprocess') -> JobResult:
+    """Run a single job (see ``run_graph`` for the modes) and return its result."""
+    start_time = time.time()
+    changes = None
+    if mode == 'inprocess' and not job.isolated:
+        ok, changes = execute_in_process(job, base_path)
+    else:
+        ok = execute_script(os.path.join(base_path, job.script), job.args)
+    return JobResult(job.name, 'ok' if ok else 'failed', time.time() - start_time, changes)
+
+
+def run_graph(jobs: List[Job], base_path: str, max_workers: int = 4,
+              upstream_limits: Optional[Dict[str, int]] = None,
+              mode: str = 'subprocess') -> Dict[str, JobResult]:
+    """Run the job graph on a bounded worker pool.
+
+    A job starts as soon as all of its dependencies succeeded, a worker is free
+    and its upstream is below its concurrency cap. Jobs whose dependencies
+    failed are skipped. Jobs are started in declaration order whenever several
+    are ready at once.
+
+    With ``mode='inprocess'`` each job module is imported once and its ``main()``
+    is called in this process, sharing the HTTP sessions and MySQL connections
+    kept by ``connections``; ``isolated`` jobs still get their own interpreter.
+    """
+    if mode not in ('subprocess', 'inprocess'):
+        raise ValueError(f"Unknown execution mode: {mode}")
+    validate_graph(jobs)
+    limits = dict(DEFAULT_UPSTREAM_LIMITS)
+    limits.update(upstream_limits or {})
+
+    pending = list(jobs)
+    results: Dict[str, JobResult] = {}
+    running = {}
+    running_per_upstream: Dict[str, int] = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Skip jobs whose dependencies did not succeed
+            for job in list(pending):
+                failed = [dep for dep in job.depends_on if dep in results and results[dep].status != 'ok']
+                if failed:
+                    logging.warning(f"Skipping {job.name}: dependency {', '.join(failed)} did not succeed")
+                    results[job.name] = JobResult(job.name, 'skipped')
+                    pending.remove(job)
+
+            # Start every job that is ready and fits in the worker and upstream limits
+            for job in list(pending):
+                if len(running) >= max_workers:
+                    break
+                if not all(dep in results for dep in job.depends_on):
+                    continue
+                if running_per_upstream.get(job.upstream, 0) >= limits.get(job.upstream, max_workers):
+                    continue
+                future = executor.submit(run_job, job, base_path, mode)
+                running[future] = job
+                running_per_upstream[job.upstream] = running_per_upstream.get(job.upstream, 0) + 1
+                pending.remove(job)
+
+            if not running:
+                # Only reachable if the remaining jobs can never become ready
+                for job in pending:
+                    results[job.name] = JobResult(job.name, 'skipped')
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                running_per_upstream[job.upstream] -= 1
+                try:
+                    results[job.name] = future.result()
+                except Exception as e:
+                    logging.exception(f"Unexpected error running job {job.name}: {e}")
+                    results[job.name] = JobResult(job.name, 'failed')
+
+    return {job.name: results[job.name] for job in jobs}
+
+
+def log_summary(results: Dict[str, JobResult], wall_clock: float):
+    """Log per-job status and how much the parallel run saved over a sequential one."""
+    serial_time = sum(result.seconds for result in results.values())
+    for result in results.values():
+        changes = f", {result.changes} changes" if result.changes is not None else ""
+        logging.info(f"{result.name}: {result.status} ({result.seconds:.2f} seconds{changes})")
+    logging.info(f"Sum of job times: {serial_time:.2f} seconds, wall-clock: {wall_clock:.2f} seconds")
+    # Only in-process jobs share this process's request budgets
+    for line in throttling_report():
+        logging.info(f"Rate limit {line}")
+
+
+_subprocess_startup_seconds = None
+
+
+def measure_subprocess_startup():
+    """Time a fresh interpreter doing what every job does before its first request.
+
+    That is starting Python, importing the job dependencies and reading ``.env``.
+    Measured once per process.
+    """
+    global _subprocess_startup_seconds
+    if _subprocess_startup_seconds is None:
+        start_time = time.time()
+        subprocess.run(['python', '-c', 'import requests, mysql.connector, dateutil.parser, dotenv; dotenv.load_dotenv()'],
+                       check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _subprocess_startup_seconds = time.time() - start_time
+    return _subprocess_startup_seconds
+
+
+def log_startup_savings(results: Dict[str, JobResult], jobs: List[Job], imports_before: float):
+    """Log how much interpreter startup the in-process mode saved in this cycle.
+
+    ``imports_before`` is ``total_import_seconds()`` taken before the cycle, so only
+    module imports paid during this cycle are charged against the savings.
+    """
+    in_process = [job for job in jobs if not job.isolated and results.get(job.name)
+                  and results[job.name].status != 'skipped']
+    if not in_process:
+        return
+    startup = measure_subprocess_startup()
+    imports = total_import_seconds() - imports_before
+    saved = len(in_process) * startup - imports
+    logging.info(f"In-process mode: {len(in_process)} jobs, subprocess startup {startup:.2f} seconds each, "
+                 f"module imports this cycle {imports:.2f} seconds, estimated saving {saved:.2f} seconds")
+
+
+def total_import_seconds():
+    """Total time spent importing job modules in this process so far."""
+    with _import_lock:
+        return sum(_import_seconds.values())
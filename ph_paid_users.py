@@ -1,9 +1,20 @@
+import argparse
+import datetime
 import json
 import os
 from dotenv import load_dotenv
 
 import mysql.connector
-import requests
+
+from bulk_loader import BULK_CONNECT_ARGS, replace_table, restore_previous_table
+from connections import connect, get_session
+from db_writer import ensure_column
+import hogql
+from posthog_common import (QUERY_DEADLINE, add_query_arguments, add_refresh_arguments, plan_refresh,
+                            record_refresh, run_async_query, track_days)
+from rate_limiter import get_limiter, request
+from result_cache import CachedQuery, ResultCache, fingerprint
+from sinks import add_targets_argument, write_to_targets
 
 # Carrega as variáveis do arquivo .env
 load_dotenv()
@@ -14,22 +25,28 @@ headers = {
     'Content-Type': 'application/json',
     'Authorization': f'Bearer {os.getenv("PH_TOKEN")}'
 }
-payload = {
-    "query": {
-        "kind": "HogQLQuery",
-        "query": "SELECT\n    arrayMap(number -> plus(toStartOfMonth(assumeNotNull(toDateTime('2024-01-01 00:00:00'))), toIntervalMonth(number)), range(0, plus(coalesce(dateDiff('month', toStartOfMonth(assumeNotNull(toDateTime('2024-01-01 00:00:00'))), toStartOfMonth(assumeNotNull(toDateTime('2024-12-31 23:59:59'))))), 1))) AS date,\n    arrayMap(_match_date -> arraySum(arraySlice(groupArray(count), indexOf(groupArray(day_start) AS _days_for_count, _match_date) AS _index, plus(minus(arrayLastIndex(x -> equals(x, _match_date), _days_for_count), _index), 1))), date) AS total\nFROM\n    (SELECT\n        sum(total) AS count,\n        day_start\n    FROM\n        (SELECT\n            count(DISTINCT e.person_id) AS total,\n            toStartOfMonth(timestamp) AS day_start\n        FROM\n            events AS e SAMPLE 1\n        WHERE\n            and(greaterOrEquals(timestamp, toStartOfMonth(assumeNotNull(toDateTime('2024-01-01 00:00:00')))), lessOrEquals(timestamp, assumeNotNull(toDateTime('2024-12-31 23:59:59'))), equals(event, '$pageview'), ifNull(not(match(toString(properties.$host), '^(localhost|127\\\\.0\\\\.0\\\\.1)($|:)')), 1), notILike(properties.$pathname, '%/landing-pages/previa/%'), notILike(properties.$pathname, '%OneDrive%'), notILike(properties.$pathname, '%C:/%'), notILike(properties.$pathname, '%/render2%'), notILike(properties.$current_url, '%https://carbon-blindados.webflow.io/%'), notILike(properties.$user_id, '%carbonblindados.com.br%'), notILike(properties.$user_id, '%carbon.cars%'), or(notEquals(properties.gclid, NULL), notEquals(properties.fbclid, NULL), notEquals(properties.utm_source, NULL)))\n        GROUP BY\n            day_start)\n    GROUP BY\n        day_start\n    ORDER BY\n        day_start ASC)\nORDER BY\n    arraySum(total) DESC\nLIMIT 50000"
-    }
-}
+# Consulta HogQL; {sample} e {distinct_persons} dependem do modo (ver build_payload)
+hogql_query = "SELECT\n    arrayMap(number -> plus(toStartOfMonth(assumeNotNull(toDateTime('2024-01-01 00:00:00'))), toIntervalMonth(number)), range(0, plus(coalesce(dateDiff('month', toStartOfMonth(assumeNotNull(toDateTime('2024-01-01 00:00:00'))), toStartOfMonth(assumeNotNull(toDateTime('2024-12-31 23:59:59'))))), 1))) AS date,\n    arrayMap(_match_date -> arraySum(arraySlice(groupArray(count), indexOf(groupArray(day_start) AS _days_for_count, _match_date) AS _index, plus(minus(arrayLastIndex(x -> equals(x, _match_date), _days_for_count), _index), 1))), date) AS total\nFROM\n    (SELECT\n        sum(total) AS count,\n        day_start\n    FROM\n        (SELECT\n            {distinct_persons} AS total,\n            toStartOfMonth(timestamp) AS day_start\n        FROM\n            events AS e SAMPLE {sample}\n        WHERE\n            and(greaterOrEquals(timestamp, toStartOfMonth(assumeNotNull(toDateTime('2024-01-01 00:00:00')))), lessOrEquals(timestamp, assumeNotNull(toDateTime('2024-12-31 23:59:59'))), equals(event, '$pageview'), ifNull(not(match(toString(properties.$host), '^(localhost|127\\\\.0\\\\.0\\\\.1)($|:)')), 1), notILike(properties.$pathname, '%/landing-pages/previa/%'), notILike(properties.$pathname, '%OneDrive%'), notILike(properties.$pathname, '%C:/%'), notILike(properties.$pathname, '%/render2%'), notILike(properties.$current_url, '%https://carbon-blindados.webflow.io/%'), notILike(properties.$user_id, '%carbonblindados.com.br%'), notILike(properties.$user_id, '%carbon.cars%'), or(notEquals(properties.gclid, NULL), notEquals(properties.fbclid, NULL), notEquals(properties.utm_source, NULL)))\n        GROUP BY\n            day_start)\n    GROUP BY\n        day_start\n    ORDER BY\n        day_start ASC)\nORDER BY\n    arraySum(total) DESC\nLIMIT 50000"
+
+# Período fixo da consulta (o início não entra, como em posthog_common.window_start)
+PERIOD_START = datetime.date(2023, 12, 31)
+PERIOD_END = datetime.date(2024, 12, 31)
+
+# Função para montar a consulta: exata (SAMPLE 1, count DISTINCT) ou aproximada, numa amostra
+# de sample dos eventos com uniq, escalada de volta para o total
+def build_payload(exact=True, sample=1):
+    if exact:
+        return hogql.payload(hogql_query.format(sample=1, distinct_persons='count(DISTINCT e.person_id)'))
+    return hogql.payload(hogql_query.format(
+        sample=sample, distinct_persons=f'toInt64(round(divide(uniq(e.person_id), {sample})))'))
+
+# Colunas da tabela ph_paid_users, na ordem dos resultados
+COLUMNS = ['date', 'total', 'is_exact']
 
-# Função para conectar ao banco de dados MySQL
-def connect_to_db():
+# Função para conectar ao banco de dados MySQL indicado pelo prefixo (DB, LH_DB...)
+def connect_to_db(prefix, bulk=False):
     try:
-        conn = mysql.connector.connect(
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            host=os.getenv('DB_HOST'),
-            database=os.getenv('DB_NAME')
-        )
+        conn = connect(prefix, **(BULK_CONNECT_ARGS if bulk else {}))
         print("Conexão com o banco de dados MySQL estabelecida.")
         return conn
     except mysql.connector.Error as err:
@@ -43,47 +60,26 @@ def create_table_if_not_exists(conn):
         create_table_query = """
         CREATE TABLE IF NOT EXISTS ph_paid_users (
             date DATE,
-            total INT
+            total INT,
+            is_exact BOOLEAN
         );
         """
         cursor.execute(create_table_query)
         conn.commit()
         cursor.close()
+        # Tabelas criadas antes da coluna is_exact
+        ensure_column(conn, 'ph_paid_users', 'is_exact', 'BOOLEAN')
         print("Tabela ph_paid_users criada com sucesso.")
     except mysql.connector.Error as err:
         print(f"Error creating table: {err}")
 
-# Função para limpar a tabela
-def truncate_table(conn):
-    try:
-        cursor = conn.cursor()
-        truncate_query = "TRUNCATE TABLE ph_paid_users"
-        cursor.execute(truncate_query)
-        conn.commit()
-        cursor.close()
-        print("Tabela ph_paid_users limpa com sucesso.")
-    except mysql.connector.Error as err:
-        print(f"Error truncating table: {err}")
-
-# Função para inserir os dados no banco de dados
-def insert_data_to_db(conn, overview_data):
-    try:
-        cursor = conn.cursor()
-        insert_query = """
-        INSERT INTO ph_paid_users (
-            date, total
-        ) VALUES (%s, %s)
-        """
-        cursor.executemany(insert_query, overview_data)
-        conn.commit()
-        cursor.close()
-        print("Banco de dados atualizado com sucesso.")
-    except mysql.connector.Error as err:
-        print(f"Error inserting data: {err}")
-
 # Função para buscar dados da API do PostHog
-def fetch_posthog_data(api_url, headers, payload):
-    response = requests.post(api_url, headers=headers, data=json.dumps(payload))
+def fetch_posthog_data(api_url, headers, payload, async_query=False, deadline=QUERY_DEADLINE):
+    # Consulta assíncrona: enviar, acompanhar e cancelar se passar do prazo
+    if async_query:
+        return run_async_query(api_url, headers, payload, deadline)
+    response = request(get_session(), 'POST', api_url, get_limiter('posthog', headers.get('Authorization', '')),
+                       headers=headers, data=json.dumps(payload), timeout=deadline)
     if response.status_code == 200:
         print("Conexão com PostHog estabelecida.")
         return response.json()
@@ -91,27 +87,133 @@ def fetch_posthog_data(api_url, headers, payload):
         print(f"Error fetching data from PostHog: {response.status_code}")
         return None
 
-def main():
-    # Buscar dados da API do PostHog
-    data = fetch_posthog_data(api_url, headers, payload)
-    if data:
-        results = data['results']
-        dates = results[0][0]
-        totals = results[0][1]
-        
-        # Combinar as datas e os totais em pares
-        overview_data = list(zip(dates, totals))
-
-        # Conectar ao banco de dados
-        conn = connect_to_db()
-        if conn:
-            # Criar a tabela, se ela não existir
-            create_table_if_not_exists(conn)
-            # Limpar a tabela
-            truncate_table(conn)
-            # Inserir os dados na tabela
-            insert_data_to_db(conn, overview_data)
+# Função para buscar o resultado como as outras consultas do PostHog (uma lista de páginas): aqui é
+# uma página só, com uma linha com os vetores de meses e de totais, então não há o que paginar
+def fetch_result(payload, async_query=False, deadline=QUERY_DEADLINE):
+    data = fetch_posthog_data(api_url, headers, payload, async_query, deadline)
+    if not data:
+        raise RuntimeError("PostHog query failed")
+    yield data['results']
+
+# Função para buscar o resultado, do cache quando o período já fechou (ver result_cache)
+def fetch_pages(query, async_query=False, deadline=QUERY_DEADLINE):
+    return query.pages(lambda: fetch_result(query(), async_query, deadline))
+
+# Função para ler os argumentos de linha de comando
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Atualiza a tabela ph_paid_users com dados do PostHog.')
+    parser.add_argument('--bulk-load', action='store_true',
+                        help='Carrega a cópia da tabela com LOAD DATA LOCAL INFILE em vez de INSERT.')
+    parser.add_argument('--rollback', action='store_true',
+                        help='Volta a tabela ph_paid_users anterior à última atualização e sai.')
+    add_refresh_arguments(parser)
+    add_query_arguments(parser)
+    add_targets_argument(parser, default='DB')
+    return parser.parse_args(argv)
+
+# Função para recarregar a tabela: os dados vão para uma cópia (a tabela de staging),
+# publicada com um RENAME atômico, sem deixar a tabela vazia. A anterior fica em ph_paid_users_old.
+def reload_table(conn, overview_data, bulk=False):
+    try:
+        replace_table(conn, 'ph_paid_users', COLUMNS, overview_data, bulk)
+        print("Banco de dados atualizado com sucesso.")
+        return True
+    except mysql.connector.Error as err:
+        print(f"Error inserting data: {err}")
+        return False
+
+# Função para voltar a tabela anterior à última atualização
+def rollback_table(prefix):
+    conn = connect_to_db(prefix)
+    if conn:
+        try:
+            restore_previous_table(conn, 'ph_paid_users')
+            print("Tabela ph_paid_users anterior restaurada.")
+        except mysql.connector.Error as err:
+            print(f"Error restoring the previous table: {err}")
+        conn.close()
+
+# Função para manter os totais exatos já gravados: numa consulta aproximada, os meses que já têm
+# um total exato na tabela continuam com ele
+def keep_exact_rows(conn, overview_data):
+    cursor = conn.cursor()
+    cursor.execute("SELECT date, total FROM ph_paid_users WHERE is_exact")
+    exact_totals = {str(date)[:10]: total for date, total in cursor.fetchall()}
+    cursor.close()
+    return [(date, exact_totals[str(date)[:10]], True) if not is_exact and str(date)[:10] in exact_totals
+            else (date, total, is_exact) for date, total, is_exact in overview_data]
+
+# Função para recriar a tabela em um banco de destino
+def update_target(prefix, overview_data, bulk=False):
+    conn = connect_to_db(prefix, bulk)
+    if conn:
+        # Criar a tabela, se ela não existir
+        create_table_if_not_exists(conn)
+        try:
+            overview_data = keep_exact_rows(conn, overview_data)
+        except mysql.connector.Error as err:
+            print(f"Error reading the exact totals: {err}")
             conn.close()
+            return False
+        # Carregar os dados numa cópia da tabela e publicá-la
+        updated = reload_table(conn, overview_data, bulk)
+        conn.close()
+        return updated
+    return False
+
+# Função para abrir o cache de uma consulta: o período é fechado, então o resultado fica no cache até expirar
+def open_cache(payload):
+    return ResultCache('ph_paid_users', fingerprint(payload), PERIOD_START, PERIOD_END,
+                       bucket=lambda row: PERIOD_END.isoformat())
+
+# Função para montar a consulta desta execução: exata na reconciliação completa (uma vez por noite
+# ou com --refresh full), aproximada por amostragem nas outras, a não ser que o resultado exato
+# já esteja no cache
+def prepare_query(args):
+    refresh = plan_refresh('ph_paid_users', args.targets, args.refresh, args.full_rebuild_hours)
+    exact_payload = build_payload(True)
+    if refresh != 'full' and not args.no_cache:
+        exact_cache = open_cache(exact_payload)
+        if exact_cache.complete:
+            print("Resultado exato de ph_paid_users no cache.")
+            return 'full', CachedQuery(lambda **page: exact_payload, exact_cache)
+        exact_cache.close()
+    if refresh == 'full':
+        print("Consulta exata de ph_paid_users.")
+        payload = exact_payload
+    else:
+        print(f"Consulta aproximada de ph_paid_users (amostra de {args.sample:g}).")
+        payload = build_payload(False, args.sample)
+    return refresh, CachedQuery(lambda **page: payload, None if args.no_cache else open_cache(payload))
+
+# Função para gravar o resultado da consulta em todos os bancos de destino. Devolve o número de
+# linhas que mudaram desde a atualização anterior, ou None se algum banco falhou
+def write_results(args, refresh, pages):
+    days = {}
+    results = [result for page in track_days(pages, days) for result in page]
+    dates = results[0][0]
+    totals = results[0][1]
+
+    # Combinar as datas e os totais em pares, marcando se são exatos ou aproximados
+    exact = refresh == 'full'
+    overview_data = [(date, total, exact) for date, total in zip(dates, totals)]
+
+    # Gravar os mesmos dados em todos os bancos de destino
+    updated = write_to_targets(args.targets, update_target, overview_data, args.bulk_load)
+    if all(updated.values()):
+        return record_refresh('ph_paid_users', args.targets, refresh, days)
+    return None
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    if args.rollback:
+        write_to_targets(args.targets, rollback_table)
+        return
+
+    refresh, query = prepare_query(args)
+
+    # Buscar dados da API do PostHog e gravá-los
+    return write_results(args, refresh, fetch_pages(query, args.async_query, args.query_deadline))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,127 @@
+import argparse
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import ph_overview
+import ph_paid_users
+import ph_rd_events
+import ph_rd_lp_pageviews
+from posthog_common import add_query_arguments, add_refresh_arguments
+from result_cache import cache_report
+from sinks import add_targets_argument
+
+# Runs the PostHog jobs as one. Their HogQL queries are sent at the same time
+# over the process's keep-alive session (and its PostHog request budget, see
+# rate_limiter), and each result is written to its own table by the job that
+# owns it as soon as it arrives, so the whole refresh takes about as long as the
+# slowest query. Results are fetched page by page and each page is written as it
+# arrives (see posthog_common.paginate). Each job module provides
+# prepare_query(args), fetch_pages(query, async_query, deadline) and
+# write_results(args, refresh, pages). With --async-query the queries are
+# submitted as async PostHog queries and polled, so a slow one holds no
+# connection open and is cancelled at --query-deadline.
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Queries by name: the job module that builds each one and writes its table
+QUERIES = {
+    'ph_overview': ph_overview,
+    'ph_paid_users': ph_paid_users,
+    'ph_rd_events': ph_rd_events,
+    'ph_rd_lp_pageviews': ph_rd_lp_pageviews,
+}
+
+
+def parse_queries(value):
+    """Parse a comma-separated list of query names, e.g. 'ph_overview,ph_rd_events'."""
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in QUERIES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown PostHog queries: {', '.join(unknown)}")
+    if not names:
+        raise argparse.ArgumentTypeError("At least one query is required")
+    return names
+
+
+def parse_arguments(argv=None):
+    """Parse command-line arguments; the refresh options apply to every query that supports them."""
+    parser = argparse.ArgumentParser(description='Run the PostHog queries at the same time and write each one to its table.')
+    parser.add_argument('--queries', type=parse_queries, default=list(QUERIES),
+                        help='Comma-separated queries to run (default: all of them).')
+    parser.add_argument('--bulk-load', action='store_true',
+                        help='Load the full reloads with LOAD DATA LOCAL INFILE instead of INSERT.')
+    add_refresh_arguments(parser)
+    add_query_arguments(parser)
+    add_targets_argument(parser, default='DB')
+    return parser.parse_args(argv)
+
+
+def counted_pages(pages, counts):
+    """Pass ``pages`` through, adding up their ``pages`` and ``rows`` in ``counts``."""
+    for page in pages:
+        counts['pages'] += 1
+        counts['rows'] += len(page)
+        yield page
+
+
+def run_query(name, args):
+    """Build, send and write one query, page by page.
+
+    Returns the seconds it took and the number of rows that changed since the
+    previous refresh (None if unknown, see ``posthog_common.record_refresh``).
+    """
+    job = QUERIES[name]
+    refresh, query = job.prepare_query(args)
+    start_time = time.time()
+    counts = {'pages': 0, 'rows': 0}
+    changes = job.write_results(args, refresh, counted_pages(job.fetch_pages(query, args.async_query,
+                                                                             args.query_deadline), counts))
+    query_seconds = time.time() - start_time
+    logging.info(f"{name}: {counts['rows']} result rows in {counts['pages']} pages, {query_seconds:.2f} seconds, "
+                 f"{'unknown' if changes is None else changes} changed.")
+    return query_seconds, changes
+
+
+def main(argv=None):
+    """Run every query at the same time; a failing query does not stop the others.
+
+    The job exits with an error once they all finished if any of them failed.
+    Returns the number of result rows that changed across the queries, or None
+    if that is unknown for any of them.
+    """
+    args = parse_arguments(argv)
+
+    start_time = time.time()
+    query_seconds, changes, failed = {}, {}, []
+    with ThreadPoolExecutor(max_workers=len(args.queries)) as executor:
+        futures = {name: executor.submit(run_query, name, args) for name in args.queries}
+        for name, future in futures.items():
+            try:
+                query_seconds[name], changes[name] = future.result()
+            except Exception as e:
+                logging.error(f"An unexpected error occurred in the {name} query: {e}")
+                failed.append(name)
+
+    if query_seconds:
+        slowest = max(query_seconds, key=query_seconds.get)
+        logging.info(f"PostHog queries: {sum(query_seconds.values()):.2f} seconds in total, slowest {slowest} "
+                     f"({query_seconds[slowest]:.2f} seconds), wall-clock {time.time() - start_time:.2f} seconds.")
+    for line in cache_report():
+        logging.info(f"Cache {line}")
+    if failed:
+        sys.exit(1)
+    if None in changes.values():
+        return None
+    return sum(changes.values())
+
+
+if __name__ == "__main__":
+    main()
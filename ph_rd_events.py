@@ -1,9 +1,20 @@
+import argparse
+import functools
 import json
 import os
 from dotenv import load_dotenv
 
 import mysql.connector
-import requests
+
+from bulk_loader import BULK_CONNECT_ARGS, replace_table, restore_previous_table
+from connections import connect, get_session
+from db_writer import BatchWriter, ensure_column_collation
+import hogql
+from posthog_common import (PAGE_SIZE, QUERY_DEADLINE, REFRESH_KEY, add_query_arguments, add_refresh_arguments,
+                            cached_query, paginate, plan_refresh, record_refresh, run_async_query,
+                            track_days)
+from rate_limiter import get_limiter, request
+from sinks import add_targets_argument, stream_to_targets, write_to_targets
 
 # Carrega as variáveis do arquivo .env
 load_dotenv()
@@ -12,34 +23,33 @@ load_dotenv()
 api_url = "https://app.posthog.com/api/projects/41743/query/"
 headers = {
     'Content-Type': 'application/json',
-    'Authorization': f'Bearer {os.environ["PH_TOKEN"]}'
-}
-payload = {
-    "query": {
-        "kind": "HogQLQuery",
-        "query": """SELECT 
-                        formatDateTime(timestamp, '%Y-%m-%d') AS data, 
-                        properties.Origem AS origem, 
-                        COUNT(*) AS total 
-                    FROM events 
-                    WHERE event = 'RD Station' 
-                    AND data <= formatDateTime(today(),'%Y-%m-%d') 
-                    AND data > formatDateTime(toStartOfYear(today()), '%Y-%m-%d') 
-                    GROUP BY data, origem 
-                    ORDER BY data DESC, total DESC 
-                    LIMIT 10000"""
-    }
+    'Authorization': f'Bearer {os.getenv("PH_TOKEN")}'
 }
+# Função para montar a consulta ao PostHog: eventos dos dias depois de start (expressão HogQL,
+# ver posthog_common.window_start) até hoje, a página de limit linhas a partir de offset.
+# sargable=False gera o filtro antigo, por texto.
+def build_payload(start, sargable=True, limit=PAGE_SIZE, offset=0):
+    return hogql.payload(hogql.select(
+        [f"{hogql.day('timestamp', sargable)} AS data", "ifNull(properties.Origem, '') AS origem", "COUNT(*) AS total"],
+        'events',
+        where=["event = 'RD Station'", hogql.date_range('timestamp', start, sargable=sargable)],
+        group_by=['data', 'origem'],
+        # Ordem crescente pela chave: os dias de hoje, que ainda mudam, ficam nas últimas páginas
+        order_by=['data', 'origem'],
+        limit=limit,
+        offset=offset,
+    ))
+
+# Colunas da tabela ph_rd_events, na ordem dos resultados
+COLUMNS = ['data', 'origem', 'total']
 
-# Função para conectar ao banco de dados MySQL
-def connect_to_db():
+# Chave de cada linha: uma atualização incremental substitui as linhas com a mesma chave
+KEY_COLUMNS = ['data', 'origem']
+
+# Função para conectar ao banco de dados MySQL indicado pelo prefixo (DB, LH_DB...)
+def connect_to_db(prefix, bulk=False):
     try:
-        conn = mysql.connector.connect(
-            user=os.environ['DB_USER'],
-            password=os.environ['DB_PASSWORD'],
-            host=os.environ['DB_HOST'],
-            database=os.environ['DB_NAME']
-        )
+        conn = connect(prefix, **(BULK_CONNECT_ARGS if bulk else {}))
         print("Conexão com o banco de dados MySQL estabelecida.")
         return conn
     except mysql.connector.Error as err:
@@ -53,68 +63,137 @@ def create_table_if_not_exists(conn):
         create_table_query = """
         CREATE TABLE IF NOT EXISTS ph_rd_events (
             data DATE,
-            origem VARCHAR(255),
-            total INT
+            origem VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin,
+            total INT,
+            UNIQUE KEY refresh_key (data, origem)
         );
         """
         cursor.execute(create_table_query)
         conn.commit()
         cursor.close()
+        # A chave diferencia maiúsculas e acentos, como o GROUP BY do HogQL ("Google" e "google")
+        ensure_column_collation(conn, 'ph_rd_events', 'origem', 'VARCHAR(255)', 'utf8mb4_bin')
         print("Tabela ph_rd_events criada com sucesso.")
     except mysql.connector.Error as err:
         print(f"Error creating table: {err}")
 
-# Função para limpar a tabela
-def truncate_table(conn):
+# Função para buscar dados da API do PostHog
+def fetch_posthog_data(api_url, headers, payload, async_query=False, deadline=QUERY_DEADLINE):
+    # Consulta assíncrona: enviar, acompanhar e cancelar se passar do prazo
+    if async_query:
+        return run_async_query(api_url, headers, payload, deadline)
+    response = request(get_session(), 'POST', api_url, get_limiter('posthog', headers.get('Authorization', '')),
+                       headers=headers, data=json.dumps(payload), timeout=deadline)
+    if response.status_code == 200:
+        print("Conexão com PostHog estabelecida.")
+        return response.json()
+    else:
+        print(f"Error fetching data from PostHog: {response.status_code}")
+        return None
+
+# Função para buscar o resultado de query (ver prepare_query) página por página: não há limite de
+# linhas, e só as páginas que ainda estão sendo gravadas ficam na memória
+def fetch_pages(query, async_query=False, deadline=QUERY_DEADLINE):
+    fetch = functools.partial(fetch_posthog_data, api_url, headers, async_query=async_query, deadline=deadline)
+    # Os dias já no cache (ver result_cache) não são consultados de novo
+    return query.pages(lambda: paginate(fetch, query))
+
+# Função para ler os argumentos de linha de comando
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Atualiza a tabela ph_rd_events com dados do PostHog.')
+    parser.add_argument('--bulk-load', action='store_true',
+                        help='Carrega a cópia da tabela com LOAD DATA LOCAL INFILE em vez de INSERT.')
+    parser.add_argument('--rollback', action='store_true',
+                        help='Volta a tabela ph_rd_events anterior à última atualização e sai.')
+    add_refresh_arguments(parser)
+    add_query_arguments(parser)
+    add_targets_argument(parser, default='DB')
+    return parser.parse_args(argv)
+
+# Função para recarregar a tabela: os dados vão para uma cópia (a tabela de staging),
+# publicada com um RENAME atômico, sem deixar a tabela vazia. A anterior fica em ph_rd_events_old.
+def reload_table(conn, events_data, bulk=False):
     try:
-        cursor = conn.cursor()
-        truncate_query = "TRUNCATE TABLE ph_rd_events"
-        cursor.execute(truncate_query)
-        conn.commit()
-        cursor.close()
-        print("Tabela ph_rd_events limpa com sucesso.")
+        replace_table(conn, 'ph_rd_events', COLUMNS, events_data, bulk, unique_key=(REFRESH_KEY, KEY_COLUMNS))
+        print("Banco de dados atualizado com sucesso.")
+        return True
     except mysql.connector.Error as err:
-        print(f"Error truncating table: {err}")
+        print(f"Error inserting data: {err}")
+        return False
 
-# Função para inserir os dados no banco de dados
-def insert_data_to_db(conn, events_data):
+# Função para atualizar só os dias da janela incremental, substituindo as linhas pela chave
+def upsert_recent_data(conn, events_data):
     try:
-        cursor = conn.cursor()
-        insert_query = "INSERT INTO ph_rd_events (data, origem, total) VALUES (%s, %s, %s)"
-        cursor.executemany(insert_query, events_data)
+        with BatchWriter(conn, 'ph_rd_events', COLUMNS, update_columns=COLUMNS[len(KEY_COLUMNS):]) as writer:
+            writer.add_many(events_data)
         conn.commit()
-        cursor.close()
-        print("Banco de dados atualizado com sucesso.")
+        print(f"Banco de dados atualizado com sucesso ({writer.rows_written} linhas dos últimos dias).")
+        return True
     except mysql.connector.Error as err:
-        print(f"Error inserting data: {err}")
+        print(f"Error upserting data: {err}")
+        return False
 
-# Função para buscar dados da API do PostHog
-def fetch_posthog_data(api_url, headers, payload):
-    response = requests.post(api_url, headers=headers, data=json.dumps(payload))
-    if response.status_code == 200:
-        print("Conexão com PostHog estabelecida.")
-        return response.json()
+# Função para voltar a tabela anterior à última atualização
+def rollback_table(prefix):
+    conn = connect_to_db(prefix)
+    if conn:
+        try:
+            restore_previous_table(conn, 'ph_rd_events')
+            print("Tabela ph_rd_events anterior restaurada.")
+        except mysql.connector.Error as err:
+            print(f"Error restoring the previous table: {err}")
+        conn.close()
+
+# Função para recriar a tabela em um banco de destino
+def update_target(prefix, events_data, bulk=False, refresh='full'):
+    conn = connect_to_db(prefix, bulk)
+    if not conn:
+        return False
+    # Criar a tabela, se ela não existir
+    create_table_if_not_exists(conn)
+    if refresh == 'incremental':
+        # Atualizar só os dias da janela
+        updated = upsert_recent_data(conn, events_data)
     else:
-        print(f"Error fetching data from PostHog: {response.status_code}")
-        return None
+        # Carregar os dados numa cópia da tabela e publicá-la
+        updated = reload_table(conn, events_data, bulk)
+    conn.close()
+    return updated
+
+# Função para montar a consulta desta execução: devolve o tipo de atualização e a consulta,
+# que monta o payload de cada página (ver fetch_pages). Na atualização completa, os dias
+# fechados vêm do cache e só os seguintes são consultados.
+def prepare_query(args):
+    # Reconstruir o ano inteiro ou só a janela dos últimos dias
+    refresh = plan_refresh('ph_rd_events', args.targets, args.refresh, args.full_rebuild_hours)
+    print(f"Atualização {'completa' if refresh == 'full' else 'incremental'} de ph_rd_events.")
+    return refresh, cached_query('ph_rd_events', build_payload, refresh, args)
+
+
+# Função para gravar o resultado da consulta em todos os bancos de destino. Devolve o número de
+# linhas que mudaram desde a atualização anterior, ou None se algum banco falhou
+def write_results(args, refresh, pages):
+    days = {}
+    pages = track_days(pages, days)
+    batches = ([(result[0], result[1], result[2]) for result in results] for results in pages)
+
+    # Gravar as mesmas páginas em todos os bancos de destino, à medida que chegam
+    updated = stream_to_targets(args.targets, batches, update_target, args.bulk_load, refresh)
+    if all(updated.values()):
+        return record_refresh('ph_rd_events', args.targets, refresh, days)
+    return None
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    if args.rollback:
+        write_to_targets(args.targets, rollback_table)
+        return
+
+    refresh, query = prepare_query(args)
 
-def main():
-    # Buscar dados da API do PostHog
-    data = fetch_posthog_data(api_url, headers, payload)
-    if data:
-        results = data['results']
-        events_data = [(result[0], result[1], result[2]) for result in results]
-
-        # Conectar ao banco de dados
-        conn = connect_to_db()
-        if conn:
-            # Criar a tabela, se ela não existir
-            create_table_if_not_exists(conn)
-            # Limpar a tabela
-            truncate_table(conn)
-            # Inserir os dados na tabela
-            insert_data_to_db(conn, events_data)
-            conn.close()
+    # Buscar os dados da API do PostHog e gravá-los página por página
+    return write_results(args, refresh, fetch_pages(query, args.async_query, args.query_deadline))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,231 @@
+import argparse
+import datetime
+import functools
+import hashlib
+import json
+import logging
+import os
+import time
+
+from connections import get_session
+from rate_limiter import get_limiter, request
+from result_cache import CachedQuery, ResultCache, fingerprint, first_day
+from sync_state import load_state, update_state
+
+# Refresh planning shared by the PostHog jobs. The daily aggregates of past days
+# no longer change once their events are in, so between full rebuilds a job
+# only queries the last few days and upserts them on the table's key
+# (REFRESH_KEY). The full rebuild of the year runs when the last one is older
+# than --full-rebuild-hours (once a night with the default) or on demand with
+# --refresh full.
+
+# Days re-queried by an incremental refresh, today included
+REFRESH_WINDOW_DAYS = int(os.getenv('PH_REFRESH_DAYS', '3'))
+
+# Name of the unique key an incremental refresh upserts on
+REFRESH_KEY = 'refresh_key'
+
+# Rows per page of a paginated query (see paginate). PostHog caps a single
+# response, so results larger than a page are fetched with LIMIT/OFFSET.
+PAGE_SIZE = int(os.getenv('PH_PAGE_SIZE', '10000'))
+
+# Sample ratio of the approximate queries run between full rebuilds (ph_paid_users)
+SAMPLE_RATIO = float(os.getenv('PH_SAMPLE', '0.1'))
+
+# Seconds a PostHog query may take: the read timeout of a blocking request, or
+# the time after which an async query (--async-query) is cancelled
+QUERY_DEADLINE = float(os.getenv('PH_QUERY_DEADLINE', '600'))
+
+# Polling of an async query: the first wait, grown by POLL_BACKOFF up to MAX_POLL_INTERVAL
+POLL_INTERVAL = 1.0
+POLL_BACKOFF = 1.5
+MAX_POLL_INTERVAL = 15.0
+
+# HogQL start (exclusive) of the period covered by a full rebuild
+FULL_REBUILD_START = 'toStartOfYear(today())'
+
+
+def parse_sample(value):
+    """Parse a sample ratio for ``SAMPLE``: a number in (0, 1]."""
+    try:
+        ratio = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid sample ratio: {value}")
+    if not 0 < ratio <= 1:
+        raise argparse.ArgumentTypeError(f"The sample ratio must be in (0, 1], not {value}")
+    return ratio
+
+
+def add_refresh_arguments(parser):
+    """Add the --refresh, --window-days, --full-rebuild-hours and --sample options to a job's argument parser."""
+    parser.add_argument('--refresh', choices=['auto', 'full', 'incremental'], default='auto',
+                        help='Rebuild the whole year, only the last days, or decide automatically.')
+    parser.add_argument('--window-days', type=int, default=REFRESH_WINDOW_DAYS,
+                        help='Days (today included) re-queried by an incremental refresh.')
+    parser.add_argument('--full-rebuild-hours', type=float, default=24,
+                        help='In auto mode, rebuild the whole year when the last rebuild is older than this.')
+    parser.add_argument('--sample', type=parse_sample, default=SAMPLE_RATIO,
+                        help='Sample ratio of the approximate queries between full rebuilds (ph_paid_users).')
+
+
+def add_query_arguments(parser):
+    """Add the --async-query, --query-deadline and --no-cache options to a job's argument parser."""
+    parser.add_argument('--async-query', action='store_true', default=os.getenv('PH_ASYNC_QUERY') == '1',
+                        help='Submit the queries as async PostHog queries and poll for their results.')
+    parser.add_argument('--query-deadline', type=float, default=QUERY_DEADLINE,
+                        help='Seconds a query may take before it fails (an async query is also cancelled).')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Query every day of a full rebuild instead of reading the closed days from result_cache.')
+
+
+def state_key(job, targets):
+    """Sync state key of a job written to a given set of database targets."""
+    return f"posthog:{job}:{','.join(sorted(targets))}"
+
+
+def plan_refresh(job, targets, mode='auto', full_rebuild_hours=24):
+    """Decide between a ``'full'`` rebuild and an ``'incremental'`` refresh.
+
+    Without a recorded full rebuild (which also adds the table's REFRESH_KEY)
+    the refresh is always full.
+    """
+    last_full = load_state(state_key(job, targets)).get('last_full_rebuild')
+    if mode == 'full' or last_full is None:
+        return 'full'
+    if mode == 'auto' and time.time() - last_full >= full_rebuild_hours * 3600:
+        return 'full'
+    return 'incremental'
+
+
+def window_start(kind, window_days=REFRESH_WINDOW_DAYS):
+    """HogQL expression of the day after which a refresh of this kind queries events."""
+    if kind == 'full':
+        return FULL_REBUILD_START
+    return f"minus(today(), toIntervalDay({int(window_days)}))"
+
+
+def cached_query(job, build_payload, refresh, args, **rules):
+    """Page builder of this run's query, ``build_payload(start, limit=..., offset=...)``.
+
+    A full rebuild reads the closed days from the job's result cache and only
+    queries the days after them; ``rules`` are the job's ``ResultCache`` options
+    (settle_days, max_age_days). Incremental refreshes only query their window.
+    """
+    start = window_start(refresh, args.window_days)
+    if refresh != 'full' or args.no_cache:
+        return CachedQuery(functools.partial(build_payload, start))
+    # FULL_REBUILD_START, the start of the year, as a local date
+    cache = ResultCache(job, fingerprint(build_payload(start)), datetime.date.today().replace(month=1, day=1), **rules)
+    return CachedQuery(functools.partial(build_payload, cache.start(start)), cache)
+
+
+def track_days(pages, days):
+    """Pass ``pages`` through, filling ``days`` with the digest and row count of each day's rows.
+
+    ``days`` maps the day of a row (see ``result_cache.first_day``) to
+    ``[md5 of its rows, row count]`` once every page went through.
+    """
+    digests, counts = {}, {}
+    for page in pages:
+        for row in page:
+            day = first_day(row)
+            digests.setdefault(day, hashlib.md5()).update(json.dumps(row, default=str).encode('utf-8'))
+            counts[day] = counts.get(day, 0) + 1
+        yield page
+    for day, digest in digests.items():
+        days[day] = [digest.hexdigest(), counts[day]]
+
+
+def record_refresh(job, targets, kind, days=None):
+    """Remember a refresh that was written to every target and return how many of its rows changed.
+
+    ``days`` (see ``track_days``) is compared with the days stored by the
+    previous refreshes: the rows of a day count as changed when the day is new
+    or its digest differs. A full rebuild replaces the stored days and an
+    incremental refresh updates those of its window. Without ``days`` the
+    change count is unknown (None).
+    """
+    key = state_key(job, targets)
+    values = {'last_refresh': time.time()}
+    if kind == 'full':
+        values['last_full_rebuild'] = time.time()
+    changes = None
+    if days is not None:
+        previous = load_state(key).get('days') or {}
+        changes = sum(rows for day, (digest, rows) in days.items() if (previous.get(day) or [None])[0] != digest)
+        values['days'] = days if kind == 'full' else {**previous, **days}
+    update_state(key, **values)
+    return changes
+
+
+def paginate(fetch, query, page_size=PAGE_SIZE):
+    """Yield the result rows of a query one page at a time.
+
+    ``query(limit=..., offset=...)`` builds the payload of a page and must order
+    its rows on their unique key ascending, so the pages neither overlap nor
+    skip rows: today's rows, which still change and may appear between two
+    pages, come last and cannot shift the offsets of the pages before them;
+    ``fetch(payload)`` sends it and returns the response JSON, or None on
+    failure, which raises here. Pages are requested until one comes back short.
+    """
+    offset = 0
+    while True:
+        data = fetch(query(limit=page_size, offset=offset))
+        if not data:
+            raise RuntimeError(f"PostHog query failed at offset {offset}")
+        rows = data.get('results') or []
+        yield rows
+        if len(rows) < page_size:
+            return
+        offset += len(rows)
+
+
+def query_url(api_url, query_id):
+    """URL of a submitted async query, for polling (GET) and cancelling (DELETE)."""
+    return f"{api_url.rstrip('/')}/{query_id}/"
+
+
+def run_async_query(api_url, headers, payload, deadline=QUERY_DEADLINE):
+    """Submit ``payload`` as an async PostHog query and poll until it completes.
+
+    Polls start after POLL_INTERVAL seconds and back off by POLL_BACKOFF; the
+    thread only sleeps in between, so the other queries of the process go on.
+    A query still running after ``deadline`` seconds is cancelled. Returns the
+    response JSON, as a blocking request would, or None on failure.
+    """
+    session = get_session()
+    limiter = get_limiter('posthog', headers.get('Authorization', ''))
+    started = time.monotonic()
+    response = request(session, 'POST', api_url, limiter, headers=headers,
+                       json=dict(payload, refresh='async'), timeout=deadline)
+    if response.status_code not in (200, 202):
+        logging.error(f"Error submitting the PostHog query: HTTP {response.status_code}")
+        return None
+    data = response.json()
+    status = data.get('query_status')
+    # Results already in PostHog's cache come back with the submission
+    if not status:
+        return data
+
+    url = query_url(api_url, status['id'])
+    interval = POLL_INTERVAL
+    while True:
+        if status.get('error'):
+            logging.error(f"PostHog query {status['id']} failed: {status.get('error_message')}")
+            return None
+        if status.get('complete'):
+            logging.info(f"PostHog query {status['id']} completed in {time.monotonic() - started:.2f} seconds.")
+            return status.get('results')
+        remaining = deadline - (time.monotonic() - started)
+        if remaining <= 0:
+            cancel_response = request(session, 'DELETE', url, limiter, headers=headers, timeout=30)
+            logging.error(f"PostHog query {status['id']} still running after {deadline:.0f} seconds, "
+                          f"cancelled (HTTP {cancel_response.status_code}).")
+            return None
+        time.sleep(min(interval, remaining))
+        interval = min(interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+        response = request(session, 'GET', url, limiter, headers=headers, timeout=max(remaining, 1))
+        if response.status_code != 200:
+            logging.error(f"Error polling PostHog query {status['id']}: HTTP {response.status_code}")
+            return None
+        status = response.json()['query_status']
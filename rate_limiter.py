@@ -0,0 +1,183 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# Request budgets shared by every thread of the process that talks to the same
+# upstream with the same credentials. Each budget is a token bucket (requests
+# per second) plus an AIMD window on the requests in flight: every successful
+# request widens the window a little, a 429 halves it and pauses the upstream
+# for its Retry-After. The time spent waiting is reported per budget.
+
+# Default budgets per upstream. Each can be overridden with <PREFIX>_RATE_LIMIT
+# (requests per second), <PREFIX>_BURST and <PREFIX>_CONCURRENCY.
+DEFAULT_LIMITS = {
+    'rd_station': {'env_prefix': 'RD', 'rate': 2, 'burst': 10, 'max_concurrency': 8},
+    'posthog': {'env_prefix': 'PH', 'rate': 1, 'burst': 5, 'max_concurrency': 4},
+    'trello': {'env_prefix': 'TRELLO', 'rate': 8, 'burst': 20, 'max_concurrency': 8},
+}
+
+# Pause after a 429 without Retry-After, doubled on every consecutive retry
+DEFAULT_BACKOFF = 2.0
+MAX_BACKOFF = 120.0
+
+_lock = threading.Lock()
+_limiters = {}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` requests per second with bursts of up to ``burst``."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a request may be sent. Returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class AdaptiveLimiter:
+    """Token bucket plus an AIMD limit on concurrent requests, for one upstream and credential.
+
+    The window starts small, at ``initial_concurrency``, and grows up to
+    ``max_concurrency`` as requests succeed: by 1 per success until the first
+    throttled response (slow start), then by ``1 / window`` (about +1 per window
+    of successes). A throttled request halves it, down to ``min_concurrency``,
+    and holds every request until the pause ends.
+    """
+
+    def __init__(self, name, rate, burst=1, max_concurrency=4, min_concurrency=1, initial_concurrency=2):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.window = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.slow_start = True
+        self.requests = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Wait for a slot in the window and a token. Returns the seconds spent waiting."""
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    self._cond.wait(self._paused_until - now)
+                elif self._in_flight >= int(self.window):
+                    self._cond.wait()
+                else:
+                    break
+            self._in_flight += 1
+        self.bucket.acquire()
+        waited = time.monotonic() - start
+        with self._cond:
+            self.requests += 1
+            self.wait_seconds += waited
+        return waited
+
+    def release(self, throttled=False, pause=0.0):
+        """Free the slot; ``throttled`` shrinks the window and pauses for ``pause`` seconds."""
+        with self._cond:
+            self._in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self.slow_start = False
+                self.window = max(self.min_concurrency, self.window / 2)
+                self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            else:
+                self.window = min(self.max_concurrency, self.window + (1 if self.slow_start else 1 / self.window))
+            self._cond.notify_all()
+
+
+def get_limiter(upstream, credential=''):
+    """Return the process-wide limiter of an upstream, one per credential (token, API key...)."""
+    digest = hashlib.sha1(credential.encode('utf-8')).hexdigest()[:8] if credential else 'default'
+    key = (upstream, digest)
+    with _lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            settings = DEFAULT_LIMITS[upstream]
+            prefix = settings['env_prefix']
+            limiter = AdaptiveLimiter(
+                f"{upstream}:{digest}",
+                rate=float(os.getenv(f'{prefix}_RATE_LIMIT', settings['rate'])),
+                burst=int(os.getenv(f'{prefix}_BURST', settings['burst'])),
+                max_concurrency=int(os.getenv(f'{prefix}_CONCURRENCY', settings['max_concurrency'])),
+            )
+            _limiters[key] = limiter
+        return limiter
+
+
+def retry_after_seconds(value):
+    """Parse a Retry-After header (seconds or an HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def request(session, method, url, limiter, max_retries=5, **kwargs):
+    """Send a request through ``limiter``, waiting out and retrying 429 responses.
+
+    A 429 (or a 503 with Retry-After) pauses the whole upstream for Retry-After
+    seconds, or an exponential back-off when the header is missing. Returns the
+    last response; raises what ``session.request`` raises.
+    """
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            response = session.request(method, url, **kwargs)
+        except BaseException:
+            limiter.release()
+            raise
+        retry_after = retry_after_seconds(response.headers.get('Retry-After'))
+        throttled = response.status_code == 429 or (response.status_code == 503 and retry_after is not None)
+        if not throttled:
+            limiter.release()
+            return response
+        pause = retry_after if retry_after is not None else min(DEFAULT_BACKOFF * 2 ** attempt, MAX_BACKOFF)
+        limiter.release(throttled=True, pause=pause)
+        if attempt == max_retries:
+            logging.warning(f"{limiter.name} throttled (HTTP {response.status_code}), "
+                            f"giving up after {max_retries + 1} attempts.")
+        else:
+            logging.warning(f"{limiter.name} throttled (HTTP {response.status_code}), "
+                            f"waiting {pause:.1f} seconds (attempt {attempt + 1} of {max_retries + 1}).")
+    return response
+
+
+def throttling_report():
+    """One line per limiter: requests, throttled responses, time spent waiting and current window."""
+    with _lock:
+        limiters = list(_limiters.values())
+    return [f"{limiter.name}: {limiter.requests} requests, {limiter.throttled} throttled, "
+            f"{limiter.wait_seconds:.2f} seconds waiting, window {limiter.window:.1f}"
+            for limiter in limiters]
@@ -0,0 +1,316 @@
+import logging
+import math
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import requests
+from requests.packages.urllib3.util.retry import Retry
+
+from connections import get_session
+from date_utils import parse_datetime
+from rate_limiter import get_limiter, request
+from sync_state import load_state, update_state
+
+# Helpers shared by the RD Station CRM deal jobs (rd_station_deals.py and its
+# rd_station_*_deals_NEW.py entry points).
+
+BASE_URL = "https://crm.rdstation.com/api/v1/deals"
+
+# Deals updated up to this long before the stored watermark are fetched again,
+# to cover clock skew and deals saved while the previous run was paging.
+WATERMARK_OVERLAP = timedelta(minutes=10)
+
+# An interrupted full sync resumes from its last good page if the next run
+# starts within this many seconds; after that the sweep starts over. A resumed
+# sweep also starts over if its pages shifted past the last deal it saw.
+CHECKPOINT_MAX_AGE = 6 * 3600
+
+
+@dataclass
+class FullSweep:
+    """Progress of a full fetch of a pipeline, possibly resumed from an earlier run.
+
+    ``last_page`` is the last page fetched successfully and ``complete`` tells
+    whether the fetch reached the end of the pipeline. Only a complete sweep
+    may delete obsolete deals. ``sweep_id`` identifies the sweep in the targets'
+    sweep state (see ``db_writer.save_sweep_state``) and ``started_at`` is when
+    its first page was fetched, which bounds the watermark it may record.
+    ``last_deal`` is the ``(_id, created_at)`` of the last deal fetched; a
+    resumed sweep starts with the one of its checkpoint.
+    """
+    start_page: int = 1
+    last_page: int = 0
+    complete: bool = False
+    sweep_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    started_at: float = field(default_factory=time.time)
+    last_deal: Optional[tuple] = None
+
+    def __post_init__(self):
+        self.last_page = self.start_page - 1
+
+    def start_over(self):
+        """Drop the checkpoint this sweep resumed from: fetch every page again, as a new sweep."""
+        self.start_page, self.last_page, self.complete = 1, 0, False
+        self.sweep_id, self.started_at, self.last_deal = uuid.uuid4().hex, time.time(), None
+
+
+def continues_after(deals, last_deal):
+    """Whether a page of deals, ordered by creation date, leaves no gap after ``last_deal``.
+
+    It does if it holds that deal, or starts with a deal created before it. If
+    deals created before it were deleted in the meantime, the page starts further
+    along and the deals in between would be missed.
+    """
+    deal_id, created_at = last_deal
+    if any(deal.get('_id') == deal_id for deal in deals):
+        return True
+    if not deals:
+        return False
+    first_created, last_created = parse_timestamp(deals[0].get('created_at')), parse_timestamp(created_at)
+    return first_created is not None and last_created is not None and first_created < last_created
+
+
+def track_last_deal(sweep, deals):
+    """Remember the last deal of a fetched page as the sweep's ``last_deal``."""
+    if deals:
+        sweep.last_deal = (deals[-1].get('_id'), deals[-1].get('created_at'))
+
+
+def rd_limiter(params):
+    """Return the request budget of the token in ``params``.
+
+    Every request made with the same token in this process, whatever the
+    pipeline, draws from one budget (RD_RATE_LIMIT requests per second, see
+    rate_limiter), which also waits out 429 responses.
+    """
+    return get_limiter('rd_station', params.get('token') or '')
+
+
+def rd_session():
+    """Return the shared RD Station session, retrying 5xx responses (429s are handled by the limiter)."""
+    retries = Retry(
+        total=5,
+        backoff_factor=1,
+        status_forcelist=[500, 502, 503, 504]
+    )
+    return get_session('rd_station', retries=retries)
+
+
+def fetch_page(session, base_url, params, page):
+    """Fetch one page of deals. Returns the response JSON, or None if the request failed."""
+    try:
+        response = request(session, 'GET', base_url, rd_limiter(params), params=dict(params, page=page), timeout=10)
+        if response.status_code == 200:
+            logging.info(f"Received RD Station data successfully, page {page}")
+            return response.json()
+        logging.error(f"Error fetching data from RD Station: HTTP {response.status_code}, page {page}")
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Request exception on page {page}: {e}")
+    return None
+
+
+def iter_rd_station_pages(base_url, params, max_workers=4, sweep=None):
+    """Yield the deals of each page of the RD Station CRM API, in page order.
+
+    Pages are ordered by creation date so that resuming a sweep at a given page
+    finds the same deals, and fetching starts at ``sweep.start_page``. The first
+    page tells how many deals there are (``total``); up to ``max_workers`` of the
+    following pages are downloaded in parallel while the caller handles the
+    current one. Without a total, or if deals were added while paging, pages
+    past the expected end are probed until one reports ``has_more`` false. At
+    most ``max_workers`` pages are held in memory. 429 and 5xx responses are
+    retried by the session's Retry policy; a page that still fails ends the
+    iteration there. ``sweep`` records the last page (and deal) fetched and
+    whether the end was reached. A resumed sweep whose first page does not
+    continue after the last deal of its checkpoint (see ``continues_after``) is
+    started over from the first page, before anything is yielded.
+    """
+    sweep = sweep if sweep is not None else FullSweep()
+    params = dict(params, order='created_at', direction='asc')
+    session = rd_session()
+    first = fetch_page(session, base_url, params, sweep.start_page)
+    if first is None:
+        return
+    if sweep.start_page > 1 and not continues_after(first['deals'], sweep.last_deal):
+        logging.warning(f"Deals were deleted before page {sweep.start_page} since the checkpoint, "
+                        "starting the sweep over.")
+        sweep.start_over()
+        first = fetch_page(session, base_url, params, sweep.start_page)
+        if first is None:
+            return
+    sweep.last_page = sweep.start_page
+    sweep.complete = not first['deals'] or not first.get('has_more')
+    track_last_deal(sweep, first['deals'])
+    yield first['deals']
+    if sweep.complete:
+        return
+
+    total = first.get('total')
+    last_page = math.ceil(total / params['limit']) if total else None
+    next_page = sweep.start_page + 1
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            while True:
+                while len(pending) < max_workers and (last_page is None or next_page <= last_page or not pending):
+                    pending.append(executor.submit(fetch_page, session, base_url, params, next_page))
+                    next_page += 1
+                data = pending.popleft().result()
+                if data is None:
+                    return
+                sweep.last_page += 1
+                if not data['deals']:
+                    sweep.complete = True
+                    return
+                sweep.complete = not data.get('has_more')
+                track_last_deal(sweep, data['deals'])
+                yield data['deals']
+                if sweep.complete:
+                    return
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def fetch_rd_station_data(base_url, params, max_workers=4):
+    """Fetch all deal data from RD Station CRM API, several pages at a time (see ``iter_rd_station_pages``)."""
+    all_deals = []
+    for deals in iter_rd_station_pages(base_url, params, max_workers):
+        all_deals.extend(deals)
+    return all_deals
+
+
+def parse_timestamp(value):
+    """Parse an RD Station timestamp (UTC if it has no offset), or None when missing or invalid."""
+    if not value:
+        return None
+    try:
+        return parse_datetime(value)
+    except (ValueError, TypeError, OverflowError) as e:
+        logging.error(f"Error parsing timestamp '{value}': {e}")
+        return None
+
+
+def fetch_updated_deals(base_url, params, since):
+    """Fetch the deals updated at or after ``since``, most recently updated first.
+
+    The pages are requested ordered by ``updated_at`` descending and paging stops
+    at the first older deal, so the cost grows with the number of changed deals
+    and not with the size of the pipeline. Returns ``(deals, complete)``;
+    ``complete`` is False when a page failed and older changes may be missing.
+    """
+    params = dict(params, order='updated_at', direction='desc')
+    deals = []
+    session = rd_session()
+    page = 1
+    while True:
+        params['page'] = page
+        try:
+            response = request(session, 'GET', base_url, rd_limiter(params), params=params, timeout=10)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Request exception: {e}")
+            return deals, False
+        if response.status_code != 200:
+            logging.error(f"Error fetching data from RD Station: HTTP {response.status_code}")
+            return deals, False
+
+        data = response.json()
+        logging.info(f"Received RD Station data successfully, page {page}")
+        for deal in data['deals']:
+            updated_at = parse_timestamp(deal.get('updated_at'))
+            if updated_at is not None and updated_at < since:
+                return deals, True
+            deals.append(deal)
+        if not data.get('has_more'):
+            return deals, True
+        page += 1
+
+
+def state_key(pipeline_id, targets):
+    """Sync state key of a pipeline written to a given set of database targets."""
+    return f"rd_station:{pipeline_id}:{','.join(sorted(targets))}"
+
+
+def plan_sync(pipeline_id, targets, mode='auto', full_sync_hours=24):
+    """Decide between a full and an incremental sync.
+
+    Returns ``('full', None)`` or ``('incremental', since)``. ``auto`` runs a full
+    reconciliation when there is no watermark yet or the last one is older than
+    ``full_sync_hours``; ``incremental`` only falls back to full without a watermark.
+    """
+    state = load_state(state_key(pipeline_id, targets))
+    watermark = parse_timestamp(state.get('updated_at'))
+    if mode == 'full' or watermark is None:
+        return 'full', None
+    if mode == 'auto' and time.time() - state.get('last_full_sync', 0) >= full_sync_hours * 3600:
+        return 'full', None
+    return 'incremental', watermark - WATERMARK_OVERLAP
+
+
+def start_sweep(pipeline_id, targets):
+    """Return the full sweep of this run, resuming an interrupted one from its checkpoint if it is recent.
+
+    The caller must still check that every target's sweep state matches the
+    resumed sweep (its ID and page) and start over otherwise. A checkpoint
+    without the last deal it saw (saved by an older version) is not resumed.
+    """
+    state = load_state(state_key(pipeline_id, targets))
+    page, sweep_id, last_deal = state.get('checkpoint_page'), state.get('sweep_id'), state.get('checkpoint_deal')
+    if page and sweep_id and last_deal and time.time() - state.get('checkpoint_at', 0) < CHECKPOINT_MAX_AGE:
+        return FullSweep(start_page=page, sweep_id=sweep_id, last_deal=tuple(last_deal),
+                         started_at=state.get('sweep_started_at') or time.time())
+    return FullSweep()
+
+
+def save_checkpoint(pipeline_id, targets, sweep):
+    """Remember how far an incomplete sweep got, once its pages are written to every target.
+
+    The next run resumes at the last good page, so that page is fetched again,
+    and checks that it still holds (or starts before) the last deal seen.
+    """
+    if sweep.last_page >= 1 and sweep.last_deal is not None:
+        update_state(state_key(pipeline_id, targets), checkpoint_page=sweep.last_page, checkpoint_at=time.time(),
+                     checkpoint_deal=list(sweep.last_deal), sweep_id=sweep.sweep_id,
+                     sweep_started_at=sweep.started_at)
+
+
+def newest_update(deals, newest=None):
+    """Return the most recent ``updated_at`` of ``deals``, or ``newest`` if it is more recent."""
+    for deal in deals:
+        updated_at = parse_timestamp(deal.get('updated_at'))
+        if updated_at is not None and (newest is None or updated_at > newest):
+            newest = updated_at
+    return newest
+
+
+def record_sync(pipeline_id, targets, kind, updated_at, sweep=None):
+    """Store the new watermark after a successful (and, for a full sync, complete) sync.
+
+    ``updated_at`` is the newest ``updated_at`` seen in this run (see
+    ``newest_update``). A full sync also clears the checkpoint of its sweep and
+    records no watermark later than the sweep's start: deals changed after it
+    on pages read before (possibly by an earlier, interrupted run) were missed.
+    """
+    key = state_key(pipeline_id, targets)
+    if sweep is not None:
+        started_at = datetime.fromtimestamp(sweep.started_at, timezone.utc)
+        newest = started_at if updated_at is None else min(updated_at, started_at)
+    else:
+        newest = parse_timestamp(load_state(key).get('updated_at'))
+        if updated_at is not None and (newest is None or updated_at > newest):
+            newest = updated_at
+
+    values = {}
+    if newest is not None:
+        values['updated_at'] = newest.isoformat()
+    if kind == 'full':
+        values['last_full_sync'] = time.time()
+        values['checkpoint_page'] = None
+        values['checkpoint_deal'] = None
+        values['sweep_id'] = None
+    update_state(key, **values)
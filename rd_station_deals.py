@@ -0,0 +1,346 @@
+import logging
+from dotenv import load_dotenv
+import mysql.connector
+from mysql.connector.constants import ClientFlag
+import os
+import sys
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from bulk_loader import (BULK_CONNECT_ARGS, create_staging_table, drop_staging_table, load_rows,
+                         merge_staging_table, staging_changes, staging_table)
+from connections import connect
+from db_writer import (DEFAULT_BATCH_SIZE, HASH_COLUMN, add_sweep_keys, create_sweep_table, ensure_hash_column,
+                       finish_sweep, load_sweep_state, row_hash, save_sweep_state, upsert_changed_rows)
+from deal_columns import BDR_DEALS, SDR_DEALS, DealExtractor, create_table_query
+from rd_station_common import (BASE_URL, FullSweep, fetch_updated_deals, iter_rd_station_pages, newest_update,
+                               plan_sync, record_sync, save_checkpoint, start_sweep)
+from sinks import add_targets_argument, stream_to_targets, write_to_targets
+
+# Syncs the deals of several RD Station CRM pipelines at the same time. All of
+# them share the process's RD session, its request budget (see
+# rd_station_common) and the MySQL connection pools, so the whole sync takes
+# about as long as the largest pipeline.
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+TOKEN = os.getenv('RD_CRM_TOKEN')
+
+
+@dataclass(frozen=True)
+class Pipeline:
+    """A deal pipeline and the table its deals are written to."""
+    name: str
+    pipeline_id: str
+    table: str
+    extractor: DealExtractor
+
+
+# Pipelines known by name: variable holding the pipeline ID, table and columns.
+# Any other pipeline is given as name=ID and gets the shared deal columns.
+KNOWN_PIPELINES = {
+    'sdr': ('RD_SDR_ID', 'rd_crm_sdr_deals', SDR_DEALS),
+    'bdr': ('RD_BDR_ID', 'rd_crm_bdr_deals', BDR_DEALS),
+}
+
+
+def parse_pipelines(value):
+    """Parse a comma-separated list of pipelines, e.g. 'sdr,bdr' or 'sdr,vendas=64b0...'.
+
+    ``name=ID`` overrides the ID of a known pipeline or adds another one, written
+    to ``rd_crm_<name>_deals``.
+    """
+    pipelines = []
+    for entry in value.split(','):
+        name, _, pipeline_id = entry.strip().partition('=')
+        if not name:
+            continue
+        if name in KNOWN_PIPELINES:
+            id_var, table, extractor = KNOWN_PIPELINES[name]
+            pipelines.append(Pipeline(name, pipeline_id or os.getenv(id_var), table, extractor))
+        elif pipeline_id:
+            pipelines.append(Pipeline(name, pipeline_id, f'rd_crm_{name}_deals', SDR_DEALS))
+        else:
+            raise argparse.ArgumentTypeError(f"Unknown pipeline '{name}', give it as {name}=<pipeline ID>")
+    if not pipelines:
+        raise argparse.ArgumentTypeError("At least one pipeline is required")
+    return pipelines
+
+
+# Validate required environment variables
+def validate_env_vars(pipelines=(), targets=()):
+    """Check the RD Station token, the pipeline IDs and the connection variables of each database target."""
+    missing_vars = [] if TOKEN else ['RD_CRM_TOKEN']
+    missing_vars += [KNOWN_PIPELINES[pipeline.name][0] for pipeline in pipelines if not pipeline.pipeline_id]
+    missing_vars += [f'{target}_{name}' for target in targets for name in ('USER', 'PASSWORD', 'HOST', 'NAME')
+                     if not os.getenv(f'{target}_{name}')]
+    if missing_vars:
+        logging.error(f"Missing environment variables: {', '.join(missing_vars)}")
+        sys.exit(1)
+
+def parse_arguments(argv=None):
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description='Sync the deals of RD Station CRM pipelines.')
+    parser.add_argument('--pipelines', type=parse_pipelines, default=os.getenv('RD_PIPELINES', 'sdr,bdr'),
+                        help='Comma-separated pipelines to sync at the same time (sdr, bdr or name=ID).')
+    parser.add_argument('--limit', type=int, default=200, help='Number of records per page.')
+    parser.add_argument('--page-workers', type=int, default=4, help='Number of pages fetched at the same time per pipeline.')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Maximum number of deals per INSERT statement.')
+    parser.add_argument('--sync', choices=['auto', 'full', 'incremental'], default='auto',
+                        help='Full reconciliation, only deals changed since the last run, or decide automatically.')
+    parser.add_argument('--full-sync-hours', type=float, default=24,
+                        help='In auto mode, run a full reconciliation when the last one is older than this.')
+    parser.add_argument('--bulk-load', action='store_true',
+                        help='On full syncs, load the deals with LOAD DATA LOCAL INFILE into a staging table and merge them.')
+    add_targets_argument(parser, default='DB')
+    return parser.parse_args(argv)
+
+def connect_to_db(prefix, bulk=False):
+    """Connect to the MySQL database of the given target (DB, LH_DB, ...).
+
+    FOUND_ROWS is disabled so that an upsert reports 0 affected rows for a deal
+    that did not change, which lets main() return the number of real changes.
+    ``bulk`` allows LOAD DATA LOCAL INFILE on the connection.
+    """
+    try:
+        conn = connect(prefix, connection_timeout=30, client_flags=[-ClientFlag.FOUND_ROWS],
+                       **(BULK_CONNECT_ARGS if bulk else {}))
+        logging.info("Connected to the MySQL database.")
+        return conn
+    except mysql.connector.Error as err:
+        logging.error(f"Error connecting to the database: {err}")
+        raise
+
+def create_table_if_not_exists(conn, pipeline):
+    """Create the pipeline's table if it does not exist."""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(create_table_query(pipeline.table, pipeline.extractor.columns, [f'{HASH_COLUMN} CHAR(32)']))
+            conn.commit()
+            logging.info(f"Table '{pipeline.table}' ensured to exist.")
+    except mysql.connector.Error as err:
+        logging.error(f"Error creating table: {err}")
+        raise
+
+def delete_obsolete_records(conn, pipeline):
+    """Delete the deals that are in the database but were not seen by the complete sweep.
+
+    The IDs fetched by the sweep are in a staging table and the obsolete rows
+    are deleted on the server in chunks, each one committed. Returns the number
+    of deleted rows.
+    """
+    try:
+        deleted = finish_sweep(conn, pipeline.table, 'id')
+        logging.info(f"Deleted {deleted} obsolete records from {pipeline.table}.")
+        return deleted
+    except mysql.connector.Error as err:
+        logging.error(f"Error deleting obsolete records: {err}")
+        raise
+
+def insert_or_update_data_to_db(conn, pipeline, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """Insert or update deal rows (see Pipeline.extractor) into the database in multi-row batches.
+
+    Deals whose content hash matches the stored ``row_hash`` are skipped, so only
+    new and changed deals are written. Returns the number of new or changed deals.
+    """
+    try:
+        counts = upsert_changed_rows(conn, pipeline.table, pipeline.extractor.names, rows, batch_size)
+        logging.info(f"{pipeline.table} updated successfully: {counts['new']} new, {counts['changed']} changed "
+                     f"and {counts['unchanged']} unchanged deals.")
+        return counts['new'] + counts['changed']
+    except mysql.connector.Error as err:
+        logging.error(f"Error inserting or updating data: {err}")
+        raise
+
+def bulk_merge_data(conn, pipeline, rows):
+    """Load deal rows into the staging table with LOAD DATA and merge the new and changed ones.
+
+    The load is committed on its own; the merge runs in a transaction left open
+    for the caller. Returns the number of new or changed deals.
+    """
+    try:
+        columns = [*pipeline.extractor.names, HASH_COLUMN]
+        loaded = load_rows(conn, staging_table(pipeline.table), columns, ((*row, row_hash(row)) for row in rows))
+        conn.start_transaction()
+        counts = staging_changes(conn, pipeline.table, 'id', HASH_COLUMN)
+        merge_staging_table(conn, pipeline.table, columns, hash_column=HASH_COLUMN)
+        logging.info(f"{pipeline.table} bulk loaded ({loaded} deals): {counts['new']} new, {counts['changed']} changed "
+                     f"and {counts['unchanged']} unchanged deals.")
+        return counts['new'] + counts['changed']
+    except mysql.connector.Error as err:
+        logging.error(f"Error bulk loading data: {err}")
+        raise
+
+def update_target(prefix, rows, pipeline, sweep=None, batch_size=DEFAULT_BATCH_SIZE, bulk=False):
+    """Write the fetched deal rows of a pipeline (a list or a stream) to one database target.
+
+    For a full sync, ``sweep`` is its FullSweep: the fetched IDs are added to the
+    sweep's staging table and, only once the sweep is complete, deals it never
+    saw are deleted. An incremental sync (no ``sweep``) only upserts. With
+    ``bulk``, the rows go through a staging table loaded with LOAD DATA instead
+    of INSERT batches. Returns the number of deals inserted, changed or deleted.
+    """
+    fetched_ids = set()
+
+    def track_ids(rows):
+        for row in rows:
+            fetched_ids.add(row[0])
+            yield row
+
+    conn = connect_to_db(prefix, bulk)
+    try:
+        # Ensure the table exists
+        create_table_if_not_exists(conn, pipeline)
+        ensure_hash_column(conn, pipeline.table)
+        if sweep is not None:
+            create_sweep_table(conn, pipeline.table)
+
+        if bulk:
+            # Load everything into the staging table, then merge it in a transaction
+            create_staging_table(conn, pipeline.table)
+            changes = bulk_merge_data(conn, pipeline, track_ids(rows))
+        else:
+            # Begin transaction
+            conn.start_transaction()
+
+            # Insert or update the data
+            changes = insert_or_update_data_to_db(conn, pipeline, track_ids(rows), batch_size)
+
+        if sweep is not None:
+            add_sweep_keys(conn, pipeline.table, 'id', fetched_ids, restart=sweep.start_page == 1)
+            if sweep.complete:
+                # Delete obsolete records (this commits the upserts and every chunk of deletes)
+                changes += delete_obsolete_records(conn, pipeline)
+            else:
+                # The keys are committed together with the page the next run resumes at
+                save_sweep_state(conn, pipeline.table, sweep.sweep_id, sweep.last_page)
+                logging.warning(f"The {pipeline.name} fetch stopped at page {sweep.last_page}, "
+                                "not deleting obsolete records.")
+
+        # Commit transaction
+        conn.commit()
+        logging.info(f"Database transaction committed successfully on {prefix} ({pipeline.table}).")
+        return changes
+    except Exception:
+        # Rollback transaction if any error occurs
+        if conn.is_connected():
+            conn.rollback()
+            logging.info(f"Database transaction rolled back due to error on {prefix} ({pipeline.table}).")
+        raise
+    finally:
+        if bulk and conn.is_connected():
+            drop_staging_table(conn, pipeline.table)
+        conn.close()
+
+def sweep_resumable(prefix, pipeline, sweep):
+    """Whether the sweep keys stored in one target belong to ``sweep`` and stop at its start page."""
+    conn = connect_to_db(prefix)
+    try:
+        create_sweep_table(conn, pipeline.table)
+        return load_sweep_state(conn, pipeline.table) == (sweep.sweep_id, sweep.start_page)
+    finally:
+        conn.close()
+
+def sync_pipeline(pipeline, args):
+    """Fetch the deals of one pipeline once and write them to every database target.
+
+    A full sync streams them: each page is transformed and queued to the writers
+    while the next pages download. If a page fails, what was fetched is kept,
+    nothing is deleted and the next run resumes from that page. Between full
+    reconciliations only the deals updated since the stored watermark are
+    fetched. ``--bulk-load`` only applies to full syncs. Returns the number of
+    deals inserted, changed or deleted (the largest of the targets).
+    """
+    params = {
+        "token": TOKEN,
+        "limit": args.limit,
+        "deal_pipeline_id": pipeline.pipeline_id
+    }
+    extract_rows = pipeline.extractor.rows
+
+    # Fetch data from RD Station: everything, or only what changed since the last run
+    kind, since = plan_sync(pipeline.pipeline_id, args.targets, args.sync, args.full_sync_hours)
+    if kind == 'incremental':
+        logging.info(f"Downloading {pipeline.name} deals updated since {since.isoformat()}...")
+        deals, complete = fetch_updated_deals(BASE_URL, params, since)
+        if not deals:
+            if complete:
+                logging.info(f"No {pipeline.name} deals changed since the last sync.")
+                return 0
+            logging.warning(f"No {pipeline.name} deals were fetched from RD Station.")
+            return 0
+
+        # Write the same deals to every database target
+        rows = extract_rows(deals)
+        changes = write_to_targets(args.targets, update_target, rows, pipeline, None, args.batch_size)
+        if complete:
+            record_sync(pipeline.pipeline_id, args.targets, kind, newest_update(deals))
+        return max(changes.values())
+
+    sweep = start_sweep(pipeline.pipeline_id, args.targets)
+    if sweep.start_page > 1 and not all(write_to_targets(args.targets, sweep_resumable, pipeline, sweep).values()):
+        # A target holds the keys of another sweep (or none): resuming would delete the deals it missed
+        logging.warning(f"The {pipeline.name} checkpoint does not match the sweep state of every target, "
+                        "starting the sweep over.")
+        sweep = FullSweep()
+    if sweep.start_page > 1:
+        logging.info(f"Resuming the download of the {pipeline.name} pipeline from page {sweep.start_page}...")
+    else:
+        logging.info(f"Downloading data from the {pipeline.name} pipeline...")
+    pages = iter_rd_station_pages(BASE_URL, params, args.page_workers, sweep)
+    first_page = next(pages, None)
+    if first_page is None:
+        logging.warning(f"No {pipeline.name} deals were fetched from RD Station.")
+        return 0
+
+    newest = None
+
+    def row_batches():
+        nonlocal newest
+        for deals in itertools.chain([first_page], pages):
+            newest = newest_update(deals, newest)
+            yield extract_rows(deals)
+
+    # Stream the same deals to every database target while the next pages download
+    changes = stream_to_targets(args.targets, row_batches(), update_target, pipeline, sweep, args.batch_size,
+                                args.bulk_load)
+    if sweep.complete:
+        record_sync(pipeline.pipeline_id, args.targets, kind, newest, sweep)
+    else:
+        # Everything fetched so far is written: the next run continues from here
+        save_checkpoint(pipeline.pipeline_id, args.targets, sweep)
+    return max(changes.values())
+
+def main(argv=None):
+    """Sync every pipeline at the same time.
+
+    A failing pipeline does not stop the others; the job exits with an error once
+    they all finished. Returns the total number of deals inserted, changed or
+    deleted.
+    """
+    args = parse_arguments(argv)
+    validate_env_vars(args.pipelines, args.targets)
+
+    changes, failed = 0, []
+    with ThreadPoolExecutor(max_workers=len(args.pipelines)) as executor:
+        futures = {pipeline.name: executor.submit(sync_pipeline, pipeline, args) for pipeline in args.pipelines}
+        for name, future in futures.items():
+            try:
+                changes += future.result()
+            except Exception as e:
+                logging.error(f"An unexpected error occurred in the {name} pipeline: {e}")
+                failed.append(name)
+
+    if failed:
+        sys.exit(1)
+    return changes
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Local cache of the PostHog results of closed days. A day's aggregates stop
+# changing once its late events are in (SETTLE_DAYS after the day), so a full
+# rebuild only has to query PostHog for the days after the ones already cached
+# and reads the rest back from here. Each job has its own SQLite file in
+# CACHE_DIR (PH_CACHE_DIR), with the result rows of each query fingerprint by
+# day (bucket) and the last day they cover. Set PH_CACHE_DIR to move it.
+#
+# Invalidation: a different query text is a different fingerprint, a new year
+# starts a new period, and the cached days of a fingerprint are dropped once
+# they are older than MAX_AGE_DAYS, which forces a full query now and then.
+
+CACHE_DIR = os.getenv('PH_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ph_cache'))
+
+# Days after which a day's results are considered final, and age of a cached period before it is queried again
+SETTLE_DAYS = int(os.getenv('PH_CACHE_SETTLE_DAYS', '2'))
+MAX_AGE_DAYS = float(os.getenv('PH_CACHE_MAX_AGE_DAYS', '7'))
+
+# Cached rows read back per page
+READ_BATCH_SIZE = 10000
+
+_lock = threading.Lock()
+_stats = {}
+
+
+def fingerprint(payload):
+    """Hash of a query payload; any change to the query text is a new cache entry."""
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def first_day(row):
+    """Bucket of a result row whose first column is its day (``YYYY-MM-DD``)."""
+    return str(row[0])[:10]
+
+
+def record_hits(job, hits, misses):
+    """Add a run's days served from the cache (``hits``) and queried from PostHog (``misses``)."""
+    with _lock:
+        totals = _stats.setdefault(job, [0, 0])
+        totals[0] += hits
+        totals[1] += misses
+
+
+def cache_report():
+    """One line per job: days served from the cache, days queried and the hit rate."""
+    with _lock:
+        stats = dict(_stats)
+    return [f"{job}: {hits} of {hits + misses} days from cache ({hits / (hits + misses) if hits + misses else 0:.1%})"
+            for job, (hits, misses) in stats.items()]
+
+
+class ResultCache:
+    """Closed days of one query of one job, after ``period_start`` (excluded) and up to ``period_end``.
+
+    ``period_end`` defaults to today. ``bucket(row)`` gives the day a result row
+    belongs to. Only the rows of days at least ``settle_days`` old are stored.
+    """
+
+    def __init__(self, job, query_fingerprint, period_start, period_end=None, settle_days=SETTLE_DAYS,
+                 max_age_days=MAX_AGE_DAYS, bucket=first_day, path=None):
+        today = datetime.date.today()
+        self.job = job
+        self.fingerprint = query_fingerprint
+        self.period_start = period_start.isoformat()
+        self.period_end = (period_end or today).isoformat()
+        self.closed_until = min(today - datetime.timedelta(days=settle_days), period_end or today).isoformat()
+        self.bucket = bucket
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        self.conn = sqlite3.connect(path or os.path.join(CACHE_DIR, f"{job}.sqlite"))
+        self.conn.execute("CREATE TABLE IF NOT EXISTS coverage (fingerprint TEXT PRIMARY KEY, "
+                          "period_start TEXT, covered_until TEXT, created_at REAL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS rows (fingerprint TEXT, bucket TEXT, row TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS rows_bucket ON rows (fingerprint, bucket)")
+        self.covered_until = self._load_coverage(max_age_days)
+
+    def _load_coverage(self, max_age_days):
+        # Drop the periods that expired, including those of queries that changed since
+        expired = time.time() - max_age_days * 86400
+        self.conn.execute("DELETE FROM rows WHERE fingerprint IN "
+                          "(SELECT fingerprint FROM coverage WHERE created_at < ?)", (expired,))
+        self.conn.execute("DELETE FROM coverage WHERE created_at < ?", (expired,))
+        self.conn.commit()
+        row = self.conn.execute("SELECT period_start, covered_until FROM coverage WHERE fingerprint = ?",
+                                (self.fingerprint,)).fetchone()
+        if row and row[0] == self.period_start:
+            return row[1]
+        self._clear()
+        return None
+
+    def _clear(self):
+        self.conn.execute("DELETE FROM rows WHERE fingerprint = ?", (self.fingerprint,))
+        self.conn.execute("DELETE FROM coverage WHERE fingerprint = ?", (self.fingerprint,))
+        self.conn.commit()
+
+    @property
+    def complete(self):
+        """Whether the whole period is cached, so PostHog need not be queried at all."""
+        return self.covered_until is not None and self.covered_until >= self.period_end
+
+    def start(self, default):
+        """HogQL start (exclusive) of the days still to query: the last cached day, or ``default``."""
+        return f"toDate('{self.covered_until}')" if self.covered_until else default
+
+    def _days(self, after, until):
+        return max(0, (datetime.date.fromisoformat(until) - datetime.date.fromisoformat(after)).days)
+
+    def _cached_pages(self):
+        cursor = self.conn.execute("SELECT row FROM rows WHERE fingerprint = ? AND bucket <= ? ORDER BY bucket DESC",
+                                   (self.fingerprint, self.covered_until))
+        while rows := cursor.fetchmany(READ_BATCH_SIZE):
+            yield [json.loads(row) for row, in rows]
+
+    def pages(self, fetch_pages):
+        """Yield the cached rows and then the pages of ``fetch_pages()``, storing their closed days.
+
+        The new days only count as cached once every page was read, so a failed
+        query leaves the cache as it was.
+        """
+        hits = self._days(self.period_start, self.covered_until) if self.covered_until else 0
+        misses = 0 if self.complete else self._days(self.covered_until or self.period_start, self.period_end)
+        if self.covered_until:
+            yield from self._cached_pages()
+        if not self.complete:
+            # Leftovers of an earlier run that failed before its coverage was recorded
+            self.conn.execute("DELETE FROM rows WHERE fingerprint = ? AND bucket > ?",
+                              (self.fingerprint, self.covered_until or ''))
+            try:
+                for page in fetch_pages():
+                    self.conn.executemany(
+                        "INSERT INTO rows (fingerprint, bucket, row) VALUES (?, ?, ?)",
+                        [(self.fingerprint, self.bucket(row), json.dumps(row)) for row in page
+                         if self.bucket(row) <= self.closed_until]
+                    )
+                    yield page
+            except BaseException:
+                self.conn.rollback()
+                raise
+            if self.closed_until > (self.covered_until or self.period_start):
+                self.conn.execute(
+                    "INSERT INTO coverage (fingerprint, period_start, covered_until, created_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (fingerprint) DO UPDATE SET covered_until = excluded.covered_until",
+                    (self.fingerprint, self.period_start, self.closed_until, time.time())
+                )
+                self.covered_until = self.closed_until
+            self.conn.commit()
+        record_hits(self.job, hits, misses)
+        logging.info(f"{self.job} cache: {hits} days from cache, {misses} queried from PostHog.")
+
+    def close(self):
+        self.conn.close()
+
+
+class CachedQuery:
+    """Page builder of a PostHog query (see ``posthog_common.paginate``) that goes through a ``ResultCache``.
+
+    Without a cache (incremental refreshes, --no-cache) the pages are only passed through.
+    """
+
+    def __init__(self, build, cache=None):
+        self.build = build
+        self.cache = cache
+
+    def __call__(self, **page):
+        return self.build(**page)
+
+    def pages(self, fetch_pages):
+        """Pages of the query: ``fetch_pages()`` is only called for the days not in the cache."""
+        if self.cache is None:
+            yield from fetch_pages()
+            return
+        try:
+            yield from self.cache.pages(fetch_pages)
+        finally:
+            self.cache.close()
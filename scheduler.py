@@ -0,0 +1,153 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from job_runner import (DEFAULT_UPSTREAM_LIMITS, Job, JobResult, run_job, log_summary, log_startup_savings,
+                        total_import_seconds, validate_graph)
+
+
+@dataclass(frozen=True)
+class Schedule:
+    """Refresh policy of a job, in seconds.
+
+    The job runs every ``interval`` seconds at first. A run that changed at least
+    ``hot_changes`` rows halves the interval (down to ``min_interval``), a run that
+    changed nothing stretches it by half (up to ``max_interval``) and anything in
+    between moves it back towards ``interval``. Failures back off exponentially up
+    to ``max_backoff``. Every delay gets +/- ``jitter`` (a fraction) of noise so the
+    jobs drift apart instead of hitting the APIs at the same moment.
+    """
+    interval: float
+    min_interval: float
+    max_interval: float
+    jitter: float = 0.1
+    hot_changes: int = 10
+    max_backoff: float = 3600
+
+
+# Default policies per upstream. Trello and the RD Station deals change all the
+# time; the year-to-date PostHog aggregates are mostly closed days.
+DEFAULT_SCHEDULES = {
+    'posthog': Schedule(interval=3600, min_interval=1800, max_interval=4 * 3600),
+    'rd_station': Schedule(interval=900, min_interval=300, max_interval=3600),
+    'trello': Schedule(interval=900, min_interval=300, max_interval=3600),
+}
+
+
+@dataclass
+class JobState:
+    """Adaptive state of a scheduled job."""
+    interval: float
+    next_run: float = 0.0
+    failures: int = 0
+
+
+def schedule_for(job: Job, schedules: Dict[str, Schedule]) -> Schedule:
+    """Return the schedule of a job: by job name first, then by upstream."""
+    schedule = schedules.get(job.name) or schedules.get(job.upstream)
+    if schedule is None:
+        raise ValueError(f"No schedule configured for job {job.name} (upstream {job.upstream})")
+    return schedule
+
+
+def next_interval(schedule: Schedule, state: JobState, result: JobResult) -> float:
+    """Update the job state after a run and return the delay until the next one."""
+    if result.status != 'ok':
+        state.failures += 1
+        return min(state.interval * 2 ** state.failures, schedule.max_backoff)
+
+    state.failures = 0
+    if result.changes is None:
+        state.interval = schedule.interval
+    elif result.changes == 0:
+        state.interval = min(state.interval * 1.5, schedule.max_interval)
+    elif result.changes >= schedule.hot_changes:
+        state.interval = max(state.interval / 2, schedule.min_interval)
+    else:
+        state.interval = (state.interval + schedule.interval) / 2
+    return state.interval
+
+
+def with_jitter(delay: float, jitter: float) -> float:
+    return delay * random.uniform(1 - jitter, 1 + jitter)
+
+
+def startable_jobs(jobs: List[Job], states: Dict[str, JobState], running: List[Job],
+                   limits: Dict[str, int], now: float) -> List[Job]:
+    """Return the due jobs that may start now, in declaration order.
+
+    A due job waits while it is still running, while one of its dependencies is
+    running (it then starts after it, with fresh data) or while its upstream
+    already runs as many jobs as its limit allows.
+    """
+    running_names = {job.name for job in running}
+    per_upstream: Dict[str, int] = {}
+    for job in running:
+        per_upstream[job.upstream] = per_upstream.get(job.upstream, 0) + 1
+    ready = []
+    for job in jobs:
+        if states[job.name].next_run > now or job.name in running_names:
+            continue
+        if any(dep in running_names for dep in job.depends_on):
+            continue
+        if per_upstream.get(job.upstream, 0) >= limits.get(job.upstream, len(jobs)):
+            continue
+        per_upstream[job.upstream] = per_upstream.get(job.upstream, 0) + 1
+        ready.append(job)
+    return ready
+
+
+def reschedule(job: Job, schedule: Schedule, state: JobState, result: JobResult):
+    """Log a finished run and set the job's next run from its result."""
+    log_summary({job.name: result}, result.seconds)
+    delay = with_jitter(next_interval(schedule, state, result), schedule.jitter)
+    state.next_run = time.time() + delay
+    logging.info(f"Next run of {job.name} in {delay / 60:.1f} minutes")
+
+
+def run_forever(jobs: List[Job], base_path: str, schedules: Optional[Dict[str, Schedule]] = None,
+                upstream_limits: Optional[Dict[str, int]] = None, mode: str = 'subprocess'):
+    """Run the jobs forever, each on its own adaptive schedule.
+
+    Every job starts as soon as it is due and is rescheduled as soon as it
+    finishes, so a slow job only delays its own next run. ``upstream_limits``
+    override ``job_runner.DEFAULT_UPSTREAM_LIMITS`` and ``mode`` is the
+    ``run_graph`` execution mode. All jobs run once at start-up.
+    """
+    validate_graph(jobs)
+    schedules = schedules or DEFAULT_SCHEDULES
+    states = {job.name: JobState(interval=schedule_for(job, schedules).interval) for job in jobs}
+    limits = dict(DEFAULT_UPSTREAM_LIMITS)
+    limits.update(upstream_limits or {})
+    running = {}  # future -> job
+    imports_before = {}
+
+    with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+        while True:
+            for job in startable_jobs(jobs, states, list(running.values()), limits, time.time()):
+                imports_before[job.name] = total_import_seconds()
+                running[executor.submit(run_job, job, base_path, mode)] = job
+
+            # Sleep until the next job is due or a running one finishes (a due job may be waiting for it)
+            now = time.time()
+            upcoming = [states[job.name].next_run for job in jobs
+                        if job not in running.values() and states[job.name].next_run > now]
+            timeout = min(upcoming) - now if upcoming else None
+            if not running:
+                time.sleep(timeout or 0)
+                continue
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                job = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.exception(f"Unexpected error running job {job.name}: {e}")
+                    result = JobResult(job.name, 'failed')
+                reschedule(job, schedule_for(job, schedules), states[job.name], result)
+                if mode == 'inprocess':
+                    log_startup_savings({job.name: result}, [job], imports_before.pop(job.name))
@@ -1,8 +1,9 @@
 import time
-import subprocess
 from datetime import datetime
 import logging
 
+from job_runner import JOBS, run_graph, log_summary, log_startup_savings, total_import_seconds
+
 # Configura o logger
 logging.basicConfig(
     level=logging.INFO,
@@ -22,16 +23,8 @@ def log_e_print(mensagem, nivel='info'):
         print(mensagem)
         logging.error(mensagem)
 
-# Lista de scripts a serem executados
-scripts = [
-    'python "c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/ph_paid_users_local.py"',
-    'python "c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/ph_overview_local.py"',
-    'python "c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/ph_rd_lp_pageviews_local.py"',
-    'python "c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/ph_rd_events_local.py"',
-    'python "c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/rd_station_SDR_deals_local_NEW.py"',
-    'python "c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/rd_station_BDR_deals_local_NEW.py"',
-    'python "c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/trello_local.py"'
-]
+# Pasta com os scripts dos jobs (a lista de jobs fica em job_runner.JOBS)
+BASE_PATH = "c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/"
 
 try:
     log_e_print("### I N Í C I O ###")
@@ -40,16 +33,11 @@ try:
     # Captura o tempo inicial do loop completo
     tempo_inicial_loop = time.time()
 
-    # Itera sobre a lista de scripts e executa cada um
-    for comando in scripts:
-        try:
-            log_e_print(f"Executando: {comando}")
-            resultado = subprocess.run(comando, shell=True, check=True)
-            log_e_print("-----------")
-        except subprocess.CalledProcessError as e:
-            log_e_print(f"O script {comando} falhou com o código de erro {e.returncode}", nivel='error')
-        except Exception as e:
-            log_e_print(f"Erro ao executar o script {comando}: {e}", nivel='error')
+    # Executa os jobs dentro deste processo, reaproveitando módulos, sessões HTTP e conexões
+    tempos_import_antes = total_import_seconds()
+    resultados = run_graph(JOBS, BASE_PATH, mode='inprocess')
+    log_summary(resultados, time.time() - tempo_inicial_loop)
+    log_startup_savings(resultados, JOBS, tempos_import_antes)
 
     # Calcula o tempo de execução total do loop
     tempo_execucao_loop = time.time() - tempo_inicial_loop
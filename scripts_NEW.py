@@ -1,28 +1,28 @@
-import os
 import time
-import subprocess
 from datetime import datetime
 import logging
 import argparse
 
-def execute_script(script_path):
-    """Execute a single script and log its status."""
-    start_time = time.time()
+from job_runner import JOBS, run_graph, log_summary, log_startup_savings, total_import_seconds
+
+def parse_upstream_limit(value):
+    """Parse an UPSTREAM=N pair for --upstream-limit."""
     try:
-        logging.info(f"Executing: {script_path}")
-        result = subprocess.run(['python', script_path], check=True)
-        execution_time = time.time() - start_time
-        logging.info(f"Completed: {script_path} in {execution_time:.2f} seconds")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Script {script_path} failed with error code {e.returncode}")
-    except Exception as e:
-        logging.exception(f"Error executing script {script_path}: {e}")
+        upstream, limit = value.split('=', 1)
+        return upstream.strip(), int(limit)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected UPSTREAM=N, got '{value}'")
 
 def main():
     # Parse command-line arguments
-    parser = argparse.ArgumentParser(description='Execute multiple scripts sequentially.')
+    parser = argparse.ArgumentParser(description='Execute the BI jobs in parallel.')
     parser.add_argument('--log-file', default='scripts_task.log', help='Path to the log file.')
     parser.add_argument('--base-path', default='c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/', help='Base path for scripts.')
+    parser.add_argument('--max-workers', type=int, default=4, help='Maximum number of jobs running at the same time.')
+    parser.add_argument('--upstream-limit', type=parse_upstream_limit, action='append', default=[],
+                        metavar='UPSTREAM=N', help='Maximum concurrent jobs per upstream API (e.g. rd_station=1).')
+    parser.add_argument('--mode', choices=['inprocess', 'subprocess'], default='inprocess',
+                        help='Run the jobs inside this process or each in its own Python interpreter.')
     args = parser.parse_args()
 
     # Configure logging
@@ -35,25 +35,18 @@ def main():
         ]
     )
 
-    # List of scripts to execute
-    scripts = [
-        os.path.join(args.base_path, 'ph_paid_users_local.py'),
-        os.path.join(args.base_path, 'ph_overview_local.py'),
-        os.path.join(args.base_path, 'ph_rd_lp_pageviews_local.py'),
-        os.path.join(args.base_path, 'ph_rd_events_local.py'),
-        os.path.join(args.base_path, 'rd_station_SDR_deals_local.py'),
-        os.path.join(args.base_path, 'rd_station_BDR_deals_local.py'),
-        os.path.join(args.base_path, 'trello_local.py')
-    ]
-
     total_start_time = time.time()
     logging.info("### START ###")
     logging.info("----------------------------------------")
 
     try:
-        # Execute scripts sequentially
-        for script_path in scripts:
-            execute_script(script_path)
+        # Execute the job graph, independent jobs in parallel
+        imports_before = total_import_seconds()
+        results = run_graph(JOBS, args.base_path, max_workers=args.max_workers,
+                            upstream_limits=dict(args.upstream_limit), mode=args.mode)
+        log_summary(results, time.time() - total_start_time)
+        if args.mode == 'inprocess':
+            log_startup_savings(results, JOBS, imports_before)
     except KeyboardInterrupt:
         logging.warning("Script execution interrupted by the user.")
     except Exception as e:
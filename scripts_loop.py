@@ -1,8 +1,8 @@
-import time
-import subprocess
-from datetime import datetime
 import logging
 
+from job_runner import JOBS
+from scheduler import run_forever
+
 # Configura o logger
 logging.basicConfig(
     level=logging.INFO,
@@ -22,50 +22,17 @@ def log_e_print(mensagem, nivel='info'):
         print(mensagem)
         logging.error(mensagem)
 
-# Lista de scripts a serem executados
-scripts = [
-    'python "c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/ph_paid_users_local.py"',
-    'python "c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/ph_overview_local.py"',
-    'python "c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/ph_rd_lp_pageviews_local.py"',
-    'python "c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/ph_rd_events_local.py"',
-    'python "c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/rd_station_SDR_deals_local.py"',
-    'python "c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/rd_station_BDR_deals_local.py"',
-    'python "c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/trello_local.py"'
-]
+# Pasta com os scripts dos jobs (a lista de jobs fica em job_runner.JOBS)
+BASE_PATH = "c:/Users/Administrator/OneDrive - CARBON CARS/PowerBI/Scripts/carbon-bi/"
 
 try:
-    while True:
-        log_e_print("### I N Í C I O ###")
-        log_e_print("----------------------------------------")
-
-        # Captura o tempo inicial do loop completo
-        tempo_inicial_loop = time.time()
-
-        # Itera sobre a lista de scripts e executa cada um
-        for comando in scripts:
-            try:
-                log_e_print(f"Executando: {comando}")
-                resultado = subprocess.run(comando, shell=True, check=True)
-                log_e_print("-----------")
-            except subprocess.CalledProcessError as e:
-                log_e_print(f"O script {comando} falhou com o código de erro {e.returncode}", nivel='error')
-            except Exception as e:
-                log_e_print(f"Erro ao executar o script {comando}: {e}", nivel='error')
-
-        # Calcula o tempo de execução total do loop
-        tempo_execucao_loop = time.time() - tempo_inicial_loop
-
-        # Captura o horário de término da execução do loop
-        horario_termino_loop = datetime.now().strftime("%H:%M:%S")
-
-        # Exibe o tempo de execução total e o horário de término do loop
-        log_e_print(f"Tempo total de execução do loop: {tempo_execucao_loop:.2f} segundos")
-        log_e_print(f"Horário de término do loop: {horario_termino_loop}")
-        log_e_print("----------------------------------------")
-        log_e_print("### F I M ###")
+    log_e_print("### I N Í C I O ###")
+    log_e_print("----------------------------------------")
 
-        # Aguarda 30 minutos (1800 segundos) antes de repetir o loop
-        time.sleep(1800)
+    # Executa cada job dentro deste processo, no seu próprio intervalo adaptativo
+    # (ver scheduler.DEFAULT_SCHEDULES): mais cedo quando a última execução
+    # encontrou muitas mudanças, mais tarde quando não encontrou nenhuma
+    run_forever(JOBS, BASE_PATH, mode='inprocess')
 
 except KeyboardInterrupt:
     log_e_print("Script interrompido pelo usuário.")
@@ -0,0 +1,114 @@
+import logging
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+# A job fetches and transforms its data once and then writes the same rows to
+# every MySQL target in its list. A target is the prefix of its connection
+# variables: 'DB' reads DB_USER/DB_PASSWORD/DB_HOST/DB_NAME (cloud database),
+# 'LH_DB' reads LH_DB_USER/... (local database).
+
+# Batches a streaming producer may get ahead of the slowest writer.
+DEFAULT_QUEUE_SIZE = 8
+
+_DONE = object()
+_ABORT = object()
+
+
+class StreamAborted(Exception):
+    """Raised inside a streaming writer when the producer failed, so it rolls back."""
+
+
+def parse_targets(value):
+    """Parse a comma-separated list of target prefixes, e.g. 'DB,LH_DB'."""
+    targets = [target.strip() for target in value.split(',') if target.strip()]
+    if not targets:
+        raise ValueError("At least one database target is required")
+    return targets
+
+
+def add_targets_argument(parser, default='DB'):
+    """Add the --targets option to a job's argument parser.
+
+    The default can be overridden for every job with the DB_TARGETS variable.
+    """
+    parser.add_argument('--targets', type=parse_targets, default=parse_targets(os.getenv('DB_TARGETS', default)),
+                        help='Comma-separated database targets to write to (e.g. DB,LH_DB).')
+
+
+def write_to_targets(targets, write, *args):
+    """Call ``write(target, *args)`` for every target at the same time.
+
+    Returns a dict of each target's return value. Every target is attempted even
+    if another one fails; the first error is raised once all writes finished.
+    """
+    if len(targets) == 1:
+        return {targets[0]: write(targets[0], *args)}
+
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        futures = {target: executor.submit(write, target, *args) for target in targets}
+    return _collect(futures)
+
+
+def _collect(futures):
+    results, errors = {}, []
+    for target, future in futures.items():
+        try:
+            results[target] = future.result()
+        except BaseException as e:
+            logging.error(f"Error writing to target {target}: {e}")
+            errors.append(e)
+    if errors:
+        raise errors[0]
+    return results
+
+
+def _queued_rows(batches):
+    while True:
+        batch = batches.get()
+        if batch is _DONE:
+            return
+        if batch is _ABORT:
+            raise StreamAborted("The producer failed before the end of the stream")
+        yield from batch
+
+
+def _stream_writer(write, target, batches, args):
+    rows = _queued_rows(batches)
+    try:
+        return write(target, rows, *args)
+    finally:
+        # Keep consuming after a failed write so the producer never blocks on this queue
+        try:
+            for _ in rows:
+                pass
+        except StreamAborted:
+            pass
+
+
+def stream_to_targets(targets, batches, write, *args, queue_size=DEFAULT_QUEUE_SIZE):
+    """Stream ``batches`` of rows to ``write(target, rows, *args)`` on one writer thread per target.
+
+    ``batches`` is consumed in the calling thread (e.g. downloading and
+    transforming the next page) while the writers insert the previous ones, and
+    each writer receives the rows as one iterator. At most ``queue_size`` batches
+    wait per target, so memory stays bounded. If producing fails, the writers
+    see ``StreamAborted`` and the producer's error is raised. Returns a dict of
+    each target's return value, like ``write_to_targets``.
+    """
+    queues = {target: queue.Queue(maxsize=queue_size) for target in targets}
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        futures = {target: executor.submit(_stream_writer, write, target, queues[target], args)
+                   for target in targets}
+        end = _DONE
+        try:
+            for batch in batches:
+                for target_queue in queues.values():
+                    target_queue.put(batch)
+        except BaseException:
+            end = _ABORT
+            raise
+        finally:
+            for target_queue in queues.values():
+                target_queue.put(end)
+    return _collect(futures)
@@ -0,0 +1,83 @@
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the threads of one process are serialized
+    fcntl = None
+
+# Small JSON file with the state the jobs keep between runs (watermarks, time of
+# the last full sync, ...), one entry per key. Set SYNC_STATE_FILE to move it.
+# Several processes share it (the runner's subprocesses, the standalone
+# scripts), so every read-modify-write holds an flock on STATE_FILE.lock.
+STATE_FILE = os.getenv('SYNC_STATE_FILE',
+                       os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sync_state.json'))
+
+_lock = threading.Lock()
+
+
+def _read_all():
+    try:
+        with open(STATE_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.error(f"Could not read sync state from {STATE_FILE}, starting from scratch: {e}")
+        return {}
+
+
+@contextlib.contextmanager
+def _locked():
+    # The thread lock serializes this process, the file lock the other processes
+    with _lock, open(f"{STATE_FILE}.lock", 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_all(state):
+    # Write through a temporary file of its own so that a crash never leaves it half-written
+    directory, name = os.path.split(os.path.abspath(STATE_FILE))
+    tmp = tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, prefix=f"{name}.", suffix='.tmp',
+                                      delete=False)
+    try:
+        with tmp:
+            json.dump(state, tmp, indent=2, sort_keys=True)
+        os.replace(tmp.name, STATE_FILE)
+    except BaseException:
+        os.remove(tmp.name)
+        raise
+
+
+def load_state(key):
+    """Return the state stored under ``key`` (an empty dict if there is none)."""
+    with _lock:
+        return dict(_read_all().get(key, {}))
+
+
+def save_state(key, value):
+    """Replace the state stored under ``key``."""
+    with _locked():
+        state = _read_all()
+        state[key] = value
+        _write_all(state)
+
+
+def update_state(key, **values):
+    """Merge ``values`` into the state stored under ``key`` and return the result."""
+    with _locked():
+        state = _read_all()
+        entry = dict(state.get(key, {}))
+        entry.update(values)
+        state[key] = entry
+        _write_all(state)
+        return entry
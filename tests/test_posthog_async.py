@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import posthog_common
+
+
+class StubPostHog(BaseHTTPRequestHandler):
+    """PostHog query API stub: the query named 'fast' completes on its second poll, 'slow' never does."""
+
+    polls = {}
+    cancelled = []
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, status=200):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        query_id = body['query']['query']
+        self.polls[query_id] = 0
+        self._send({'query_status': {'id': query_id, 'complete': False}}, status=202)
+
+    def do_GET(self):
+        query_id = self.path.rstrip('/').rsplit('/', 1)[-1]
+        self.polls[query_id] += 1
+        complete = query_id == 'fast' and self.polls[query_id] >= 2
+        self._send({'query_status': {'id': query_id, 'complete': complete,
+                                     'results': {'results': [['2024-01-01', 3]]} if complete else None}})
+
+    def do_DELETE(self):
+        self.cancelled.append(self.path)
+        self._send({})
+
+
+class RunAsyncQueryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubPostHog)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.api_url = f"http://127.0.0.1:{cls.server.server_address[1]}/api/projects/1/query/"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubPostHog.polls.clear()
+        StubPostHog.cancelled.clear()
+        # A budget of its own, loose enough not to slow the polls down
+        self.headers = {'Authorization': f'Bearer test-{self.id()}'}
+        patcher = mock.patch.dict(os.environ, {'PH_RATE_LIMIT': '1000', 'PH_BURST': '1000'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(posthog_common, 'POLL_INTERVAL', 0.05)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_completes_after_polling(self):
+        data = posthog_common.run_async_query(self.api_url, self.headers, {'query': {'query': 'fast'}}, deadline=5)
+        self.assertEqual(data, {'results': [['2024-01-01', 3]]})
+        self.assertEqual(StubPostHog.polls['fast'], 2)
+        self.assertEqual(StubPostHog.cancelled, [])
+
+    def test_cancels_at_deadline(self):
+        data = posthog_common.run_async_query(self.api_url, self.headers, {'query': {'query': 'slow'}}, deadline=0.5)
+        self.assertIsNone(data)
+        self.assertGreater(StubPostHog.polls['slow'], 0)
+        self.assertEqual(StubPostHog.cancelled, ['/api/projects/1/query/slow/'])
+
+
+if __name__ == '__main__':
+    unittest.main()
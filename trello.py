@@ -1,10 +1,14 @@
 from dotenv import load_dotenv
 
-import mysql.connector
 from mysql.connector import Error
-import requests
+import argparse
 import os
 
+from connections import connect, get_session
+from db_writer import ensure_hash_column, upsert_changed_rows
+from rate_limiter import get_limiter, request
+from sinks import add_targets_argument, write_to_targets
+
 # Carrega as variáveis do arquivo .env
 load_dotenv()
 
@@ -16,11 +20,8 @@ BOARD_ID = f'{os.getenv("TRELLO_BOARD_ID")}'
 # Base URL for Trello API
 BASE_URL = "https://api.trello.com/1/"
 
-# MySQL connection details
-MYSQL_HOST = os.getenv('DB_HOST')
-MYSQL_DATABASE = os.getenv('DB_NAME')
-MYSQL_USER = os.getenv('DB_USER')
-MYSQL_PASSWORD = os.getenv('DB_PASSWORD')
+# Columns of trello_cards, in the order of the rows built by get_board_rows()
+CARD_COLUMNS = ['card_id', 'card_name', 'due_date', 'list_name', 'member_id', 'member_name']
 
 # Create the table if it doesn't exist
 def create_table_if_not_exists(cursor):
@@ -31,20 +32,24 @@ def create_table_if_not_exists(cursor):
         due_date DATETIME,
         list_name VARCHAR(255),
         member_id VARCHAR(255),
-        member_name VARCHAR(255)
+        member_name VARCHAR(255),
+        row_hash CHAR(32)
     );
     """
     cursor.execute(create_table_query)
 
-# Get the lists on the board
+# Get the lists on the board, or None if Trello did not return them
 def get_lists_on_board(board_id):
     url = f"{BASE_URL}boards/{board_id}/lists"
     query = {
         'key': API_KEY,
         'token': TOKEN,
     }
-    response = requests.get(url, params=query)
-    return response.json() if response.status_code == 200 else []
+    response = request(get_session(), 'GET', url, get_limiter('trello', TOKEN), params=query)
+    if response.status_code != 200:
+        print(f"Error fetching the Trello lists: HTTP {response.status_code}")
+        return None
+    return response.json()
 
 # Get all cards on a specific list with manual pagination
 def get_all_cards_from_list(list_id, limit=1000):
@@ -61,7 +66,7 @@ def get_all_cards_from_list(list_id, limit=1000):
             query['before'] = before
 
         url = f"{BASE_URL}lists/{list_id}/cards"
-        response = requests.get(url, params=query)
+        response = request(get_session(), 'GET', url, get_limiter('trello', TOKEN), params=query)
         cards = response.json()
 
         if not cards:
@@ -83,71 +88,90 @@ def get_card_members(card_id):
         'key': API_KEY,
         'token': TOKEN,
     }
-    response = requests.get(url, params=query)
+    response = request(get_session(), 'GET', url, get_limiter('trello', TOKEN), params=query)
     return response.json() if response.status_code == 200 else []
 
-# Insert data into MySQL database
-def insert_data_to_mysql(board_id):
+# Retrieve every card of the board as (card_id, card_name, due_date, list_name, member_id, member_name) rows,
+# or None if the lists of the board could not be fetched
+def get_board_rows(board_id):
+    rows = []
+    lists = get_lists_on_board(board_id)
+    if lists is None:
+        return None
+    for trello_list in lists:
+        list_name = trello_list['name']
+        cards = get_all_cards_from_list(trello_list['id'])
+
+        for card in cards:
+            card_id = card['id']
+            card_name = card['name']
+            due_date = card.get('due')  # Some cards might not have a due date
+
+            # Retrieve the members of each card
+            members = get_card_members(card_id)
+            if not members:  # Handle cards with no members
+                rows.append((card_id, card_name, due_date, list_name, None, None))
+            else:
+                for member in members:
+                    rows.append((card_id, card_name, due_date, list_name, member['id'], member['fullName']))
+    return rows
+
+# trello_cards keeps one row per card (card_id is its primary key): keep the last member of each card,
+# as the upsert did, so a card with several members is not rewritten (and counted as changed) every run
+def one_row_per_card(rows):
+    return list({row[0]: row for row in rows}.values())
+
+# Upsert the new and changed rows into the MySQL database of a target (DB, LH_DB...) in multi-row
+# batches and return how many there were (unchanged rows are skipped by their row_hash),
+# or None if the database failed, so the scheduler does not take the failure for a quiet run
+def insert_data_to_mysql(prefix, rows):
+    changed = None
+    connection = None
     try:
         # Connect to MySQL database
-        connection = mysql.connector.connect(
-            host=MYSQL_HOST,
-            database=MYSQL_DATABASE,
-            user=MYSQL_USER,
-            password=MYSQL_PASSWORD
-        )
+        connection = connect(prefix)
         if connection.is_connected():
             cursor = connection.cursor()
             
-            # Create the table if it doesn't exist
+            # Create the table if it doesn't exist (and add row_hash to a table created before it)
             create_table_if_not_exists(cursor)
+            ensure_hash_column(connection, 'trello_cards')
 
-            # Retrieve and insert cards and associated data
-            lists = get_lists_on_board(board_id)
-            for trello_list in lists:
-                list_name = trello_list['name']
-                cards = get_all_cards_from_list(trello_list['id'])
-                
-                for card in cards:
-                    card_id = card['id']
-                    card_name = card['name']
-                    due_date = card.get('due')  # Some cards might not have a due date
-
-                    # Retrieve and insert members for each card
-                    members = get_card_members(card_id)
-                    if not members:  # Handle cards with no members
-                        cursor.execute("""
-                            INSERT INTO trello_cards (card_id, card_name, due_date, list_name, member_id, member_name) 
-                            VALUES (%s, %s, %s, %s, %s, %s)
-                            ON DUPLICATE KEY UPDATE 
-                                card_name=%s, due_date=%s, list_name=%s, member_id=%s, member_name=%s
-                        """, 
-                        (card_id, card_name, due_date, list_name, None, None, 
-                         card_name, due_date, list_name, None, None))
-                    else:
-                        for member in members:
-                            member_id = member['id']
-                            member_name = member['fullName']
-                            cursor.execute("""
-                                INSERT INTO trello_cards (card_id, card_name, due_date, list_name, member_id, member_name) 
-                                VALUES (%s, %s, %s, %s, %s, %s)
-                                ON DUPLICATE KEY UPDATE 
-                                    card_name=%s, due_date=%s, list_name=%s, member_id=%s, member_name=%s
-                            """, 
-                            (card_id, card_name, due_date, list_name, member_id, member_name, 
-                             card_name, due_date, list_name, member_id, member_name))
+            counts = upsert_changed_rows(connection, 'trello_cards', CARD_COLUMNS, rows)
+            changed = counts['new'] + counts['changed']
 
             connection.commit()
-            print("Data inserted successfully into MySQL database")
+            print(f"Data inserted successfully into MySQL database ({prefix})")
 
     except Error as e:
         print(f"Error while connecting to MySQL: {e}")
     
     finally:
-        if connection.is_connected():
+        if connection is not None and connection.is_connected():
             cursor.close()
             connection.close()
             print("MySQL connection is closed")
 
+    return changed
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Sync the Trello board cards to MySQL.')
+    add_targets_argument(parser, default='DB')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_arguments(argv)
+
+    # Fetch the board once and write the same rows to every database target
+    rows = get_board_rows(BOARD_ID)
+    if rows is None:
+        # Trello failed: nothing is known about what changed
+        return None
+    rows = one_row_per_card(rows)
+    changes = write_to_targets(args.targets, insert_data_to_mysql, rows)
+    if None in changes.values():
+        return None
+    return max(changes.values())
+
 if __name__ == "__main__":
-    insert_data_to_mysql(BOARD_ID)
\ No newline at end of file
+    main()
\ No newline at end of file